@@ -3,8 +3,8 @@ import queue
 import json
 import bson
 import datetime
-import copy
 import os
+import time
 
 from PyQt5.QtCore import pyqtSlot, pyqtProperty, pyqtSignal, QObject, QThread, Qt
 from PyQt5.QtWidgets import QApplication
@@ -20,27 +20,54 @@ try:
 except ImportError as e:
     pass
 
-def hideBytes(d):
+def summarizeBytes(d):
     if type(d) == dict:
-        for k,v in d.items():
-            if type(v) in {bytes, bytearray}:
-                d[k] = "..."
-            if type(v) in {dict, list}:
-                hideBytes(d[k])
-    elif type(d) == list:
-        for i in range(len(d)):
-            if type(d[i]) in {bytes, bytearray}:
-                d[i] = "..."
-            if type(d[i]) in {dict, list}:
-                hideBytes(d[i])
+        return {k:summarizeBytes(v) for k,v in d.items()}
+    elif type(d) in {list, tuple}:
+        return [summarizeBytes(v) for v in d]
+    elif type(d) in {bytes, bytearray}:
+        return f"<{len(d)} bytes>"
+    elif type(d) in {str, int, float, bool, type(None)}:
+        return d
+    else:
+        return f"<{type(d).__name__}>"
 
 SEP = os.path.sep
 INV_SEP = {"\\": '/', '/':'\\'}[os.path.sep]
 NO_CONV = {"prompt", "negative_prompt", "url", "trace", "message"}
 
+# path-bearing fields of responses that carry large payloads, unlisted types are converted entirely
+PATH_FIELDS = {
+    "result": {"metadata"},
+    "progress": set(),
+    "artifact": set(),
+    "annotate": set(),
+    "segmentation": set(),
+    "status": set(),
+    "ack": set(),
+    "error": set(),
+    "remote_error": set(),
+    "aborted": set(),
+}
+
 def convert_path(p):
     return p.replace(INV_SEP, SEP)
 
+def convert_response_paths(response):
+    data = response.get("data", None)
+    if type(data) != dict:
+        return
+    fields = PATH_FIELDS.get(response.get("type", ""), None)
+    if fields == None:
+        convert_all_paths(data)
+        return
+    for k in fields:
+        v = data.get(k, None)
+        if type(v) == str and INV_SEP in v:
+            data[k] = convert_path(v)
+        if type(v) == list or type(v) == dict:
+            convert_all_paths(v)
+
 def convert_all_paths(j):
     if type(j) == list:
         for i in range(len(j)):
@@ -57,6 +84,120 @@ def convert_all_paths(j):
             if type(v) == list or type(v) == dict:
                 convert_all_paths(j[k])
 
+PRIORITY_INTERACTIVE = 0
+PRIORITY_CONTROL = 1
+PRIORITY_GENERATION = 2
+PRIORITY_BULK = 3
+PRIORITIES = [PRIORITY_INTERACTIVE, PRIORITY_CONTROL, PRIORITY_GENERATION, PRIORITY_BULK]
+
+REQUEST_PRIORITY = {
+    "annotate": PRIORITY_INTERACTIVE, "segmentation": PRIORITY_INTERACTIVE,
+    "options": PRIORITY_CONTROL, "manage": PRIORITY_CONTROL, "download": PRIORITY_CONTROL, "upload": PRIORITY_CONTROL,
+    "txt2img": PRIORITY_GENERATION, "img2img": PRIORITY_GENERATION, "upscale": PRIORITY_GENERATION
+}
+
+# requests with a known final response count towards the in-flight depth, everything else is sent immediately
+REQUEST_FINISHED = {
+    "txt2img": "result", "img2img": "result", "upscale": "result",
+    "annotate": "annotate", "segmentation": "segmentation", "options": "options"
+}
+
+class RequestScheduler():
+    def __init__(self, send, depth):
+        self.send = send
+        self.depth = max(1, depth)
+        self.queues = {p:{} for p in PRIORITIES}
+        self.inflight = {}
+        self.stats = {p:{"sent": 0, "wait": 0.0, "max_wait": 0.0} for p in PRIORITIES}
+
+    def submit(self, request, priority=None, source=None):
+        type = request.get("type", "")
+        if not type in REQUEST_FINISHED:
+            self.send(request)
+            return
+        if not "id" in request:
+            request["id"] = random.SystemRandom().randint(1, 2**31 - 1)
+        if priority == None:
+            priority = REQUEST_PRIORITY.get(type, PRIORITY_GENERATION)
+        queue = self.queues[priority]
+        if not source in queue:
+            queue[source] = []
+        queue[source] += [(request, priority, time.perf_counter())]
+        self.pump()
+
+    def busy(self, priority):
+        # generation work and interactive/control work have separate budgets, so a refresh never waits for a generation
+        lane = priority >= PRIORITY_GENERATION
+        return len([p for _, p in self.inflight.values() if (p >= PRIORITY_GENERATION) == lane]) >= self.depth
+
+    def next(self):
+        for priority in PRIORITIES:
+            queue = self.queues[priority]
+            if not queue or self.busy(priority):
+                continue
+            source = next(iter(queue))
+            entries = queue.pop(source)
+            entry = entries.pop(0)
+            if entries:
+                queue[source] = entries
+            return entry
+        return None
+
+    def pump(self):
+        while True:
+            entry = self.next()
+            if not entry:
+                break
+            request, priority, queued = entry
+            wait = time.perf_counter() - queued
+            stats = self.stats[priority]
+            stats["sent"] += 1
+            stats["wait"] += wait
+            stats["max_wait"] = max(stats["max_wait"], wait)
+            self.inflight[request["id"]] = (request["type"], priority)
+            self.send(request)
+
+    def cancel(self, id):
+        for queue in self.queues.values():
+            for source, entries in list(queue.items()):
+                remaining = [e for e in entries if e[0]["id"] != id]
+                if len(remaining) == len(entries):
+                    continue
+                if remaining:
+                    queue[source] = remaining
+                else:
+                    del queue[source]
+                return True
+        return False
+
+    def finish(self, response):
+        id = response.get("id", None)
+        type = response.get("type", "")
+        if type == "remote_error":
+            self.reset()
+        elif id in self.inflight and type in {REQUEST_FINISHED[self.inflight[id][0]], "error", "aborted"}:
+            del self.inflight[id]
+        self.pump()
+
+    def idle(self):
+        return not self.inflight and not any(self.queues.values())
+
+    def reset(self):
+        self.queues = {p:{} for p in PRIORITIES}
+        self.inflight = {}
+
+    def metrics(self):
+        metrics = {"inflight": len(self.inflight), "depth": self.depth}
+        for priority in PRIORITIES:
+            stats = self.stats[priority]
+            metrics[priority] = {
+                "queued": sum([len(e) for e in self.queues[priority].values()]),
+                "sent": stats["sent"],
+                "mean_wait": stats["wait"] / stats["sent"] if stats["sent"] else 0.0,
+                "max_wait": stats["max_wait"]
+            }
+        return metrics
+
 class Backend(QObject):
     updated = pyqtSignal()
     request = pyqtSignal(object)
@@ -68,11 +209,15 @@ class Backend(QObject):
         self.gui = gui
         self.responses = queue.Queue()
         self.inference = None
+        self.depth = int(gui.config.get("request_depth"))
+        self.scheduler = RequestScheduler(self.sendRequest, self.depth)
         gui.aboutToQuit.connect(self.stop)
 
     def setEndpoint(self, endpoint, password):
         self.debugLogging("NEW SESSION", {"endpoint": endpoint})
         self.inference = None
+        self.scheduler.reset()
+        self.scheduler.depth = self.depth
         if endpoint == "":
             if HAVE_TORCH and self.gui.config.get("mode") != "remote":
                 if self.gui.config.get("host_enabled"):
@@ -88,7 +233,12 @@ class Backend(QObject):
             else:
                 self.onResponse({"type": "remote_only"})
         else:
-            self.inference = remote.RemoteInference(self.gui, endpoint, password)
+            endpoints = [e.strip() for e in endpoint.split(",") if e.strip()]
+            if len(endpoints) > 1:
+                self.inference = remote.RemotePool(self.gui, endpoints, password)
+                self.scheduler.depth = self.depth * len(endpoints)
+            else:
+                self.inference = remote.RemoteInference(self.gui, endpoint, password)
         self.updated.emit()
 
         if not self.inference:
@@ -110,26 +260,42 @@ class Backend(QObject):
     
     def debugLogging(self, type, data):
         if self.gui._debugJSONLogging:
-            j = copy.deepcopy(data)
-            hideBytes(j)
-            j = json.dumps(j)
+            j = json.dumps(summarizeBytes(data))
             with open("debug.log", "a", encoding='utf-8') as f:
                 f.write(f"{type} {datetime.datetime.now()}\n{j}\n")
 
     @pyqtSlot(object)
-    def makeRequest(self, request):
+    def makeRequest(self, request, priority=None, source=None):
+        if request.get("type", "") == "cancel" and self.scheduler.cancel(request["data"]["id"]):
+            self.onResponse({"type": "aborted", "id": request["data"]["id"], "data": {}})
+            return
+        self.scheduler.submit(request, priority, source)
+
+    def sendRequest(self, request):
         self.debugLogging("REQUEST", request)
         self.request.emit(request)
 
     @pyqtSlot(object)
     def onResponse(self, response):
-        convert_all_paths(response)
+        convert_response_paths(response)
         self.debugLogging("RESPONSE", response)
+        self.scheduler.finish(response)
         self.response.emit(response)
 
+    def metrics(self):
+        return self.scheduler.metrics()
+
+    def idle(self):
+        return self.scheduler.idle()
+
+    def members(self):
+        if self.inference and type(self.inference) == remote.RemotePool:
+            return len(self.inference.members)
+        return 1
+
     @pyqtProperty(str, notify=updated)
     def mode(self):
-        if self.inference and type(self.inference) == remote.RemoteInference:
+        if self.inference and type(self.inference) in {remote.RemoteInference, remote.RemotePool}:
             return "Remote"
         elif self.inference and type(self.inference) == host.HostInference:
             return "Host"
@@ -1,11 +1,36 @@
-import glob
 import os
 
 from PyQt5.QtCore import pyqtSlot, pyqtSignal, QObject, QThreadPool, QRunnable, QFileSystemWatcher
 
+def scan_folder(folder, extensions=None, recursive=False):
+    found = []
+    pending = [folder]
+    while pending:
+        current = pending.pop(0)
+        try:
+            with os.scandir(current) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_dir():
+                    if recursive:
+                        pending += [entry.path]
+                    continue
+            except OSError:
+                continue
+            if extensions and not os.path.normcase(entry.name).endswith(extensions):
+                continue
+            found += [entry]
+    return found
+
 class WatcherRunnableSignals(QObject):
     result = pyqtSignal(str, list, list)
-    finished = pyqtSignal(str, int)
+    removed = pyqtSignal(str, list)
+    finished = pyqtSignal(str, int, object)
     def __init__(self, folder):
         super().__init__()
         self.stopping = False
@@ -17,32 +42,54 @@ class WatcherRunnableSignals(QObject):
             self.stopping = True
 
 class WatcherRunnable(QRunnable):
-    def __init__(self, folder):
+    def __init__(self, folder, snapshot=None):
         super(WatcherRunnable, self).__init__()
         self.signals = WatcherRunnableSignals(folder)
         self.folder = folder
+        self.previous = snapshot
     
     @pyqtSlot()
     def run(self):
         try:
-            files = glob.glob(os.path.join(self.folder, "*.*"))
-            files = sorted(files, key = os.path.getmtime, reverse=True)
+            entries = []
+            for entry in scan_folder(self.folder):
+                if not "." in entry.name:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries += [(os.path.abspath(entry.path), stat.st_mtime, stat.st_size, stat.st_ino)]
+            entries = sorted(entries, key = lambda e: e[1], reverse=True)
+
+            total = len(entries)
+            snapshot = {}
+            changed = []
+            for i, (file, mtime, size, inode) in enumerate(entries):
+                snapshot[file] = (total-1-i, mtime, size, inode)
+                if self.previous == None or self.previous.get(file) != snapshot[file]:
+                    changed += [file]
+
+            if self.previous:
+                removed = [file for file in self.previous if not file in snapshot]
+                if removed:
+                    self.signals.removed.emit(self.folder, removed)
 
             file_batch = []
             idx_batch = []
             batch_size = 128
-            for i, file in enumerate(files):
+            for i, file in enumerate(changed):
                 if self.signals.stopping:
                     return
-                file_batch += [os.path.abspath(file)]
-                idx_batch += [len(files)-1-i]
-                if len(file_batch) >= batch_size or i == len(files) - 1:
+                file_batch += [file]
+                idx_batch += [snapshot[file][0]]
+                if len(file_batch) >= batch_size or i == len(changed) - 1:
                     self.signals.result.emit(self.folder, file_batch, idx_batch)
                     file_batch = []
                     idx_batch = []
             
             if not self.signals.stopping:
-                self.signals.finished.emit(self.folder, len(files))
+                self.signals.finished.emit(self.folder, total, snapshot)
         except Exception:
             return
 
@@ -50,6 +97,7 @@ class Watcher(QObject):
     started = pyqtSignal(str)
     parent_changed = pyqtSignal(str)
     folder_changed = pyqtSignal(str, list, list)
+    folder_removed = pyqtSignal(str, list)
     file_changed = pyqtSignal(str)
     finished = pyqtSignal(str, int)
     kill = pyqtSignal(str)
@@ -67,6 +115,8 @@ class Watcher(QObject):
 
         self.pool = QThreadPool.globalInstance()
         self.running = {}
+        self.snapshots = {}
+        self.emitted = {}
 
         Watcher.instance = self
 
@@ -110,17 +160,35 @@ class Watcher(QObject):
         if not parent in self.parents.values():
             self.watcher.removePath(parent)
 
-    def watcherStart(self, folder):
+        if folder in self.snapshots:
+            del self.snapshots[folder]
+
+    def invalidateSnapshot(self, folder):
+        emitted = self.emitted.pop(folder, [])
+        snapshot = self.snapshots.get(folder, None)
+        if not snapshot or not emitted:
+            return
+        files = set([f for f, _ in emitted])
+        idxs = set([i for _, i in emitted])
+        self.snapshots[folder] = {k:v for k,v in snapshot.items() if not k in files and not v[0] in idxs}
+
+    def watcherStart(self, folder, full=False):
         if self.stopping:
             return
 
         if folder in self.running:
             self.running[folder].signals.result.disconnect()
+            self.running[folder].signals.removed.disconnect()
             self.running[folder].signals.finished.disconnect()
             self.kill.emit(folder)
+            self.invalidateSnapshot(folder)
+
+        if full and folder in self.snapshots:
+            del self.snapshots[folder]
 
-        watcher = WatcherRunnable(folder)
+        watcher = WatcherRunnable(folder, self.snapshots.get(folder, None))
         watcher.signals.result.connect(self.onWatcherResult)
+        watcher.signals.removed.connect(self.onWatcherRemoved)
         watcher.signals.finished.connect(self.onWatcherFinished)
         self.kill.connect(watcher.signals.die)
 
@@ -144,14 +212,23 @@ class Watcher(QObject):
             for child, parent in list(self.parents.items()):
                 if parent == folder:
                     self.watcher.addPath(child)
-                    self.watcherStart(child)
+                    self.watcherStart(child, True)
 
-    @pyqtSlot(str, int)
-    def onWatcherFinished(self, folder, total):
-        if folder in self.running:
+    @pyqtSlot(str, int, object)
+    def onWatcherFinished(self, folder, total, snapshot):
+        if folder in self.running and self.running[folder].signals == self.sender():
             del self.running[folder]
+            if folder in self.folders:
+                self.snapshots[folder] = snapshot
+            if folder in self.emitted:
+                del self.emitted[folder]
         self.finished.emit(folder, total)
 
     @pyqtSlot(str, list, list)
     def onWatcherResult(self, folder, files, idxs):
-        self.folder_changed.emit(folder, files, idxs)
\ No newline at end of file
+        self.emitted.setdefault(folder, []).extend(zip(files, idxs))
+        self.folder_changed.emit(folder, files, idxs)
+
+    @pyqtSlot(str, list)
+    def onWatcherRemoved(self, folder, files):
+        self.folder_removed.emit(folder, files)
\ No newline at end of file
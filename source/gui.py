@@ -8,7 +8,7 @@ import platform
 import urllib.parse
 IS_WIN = platform.system() == 'Windows'
 
-from PyQt5.QtCore import pyqtSlot, pyqtProperty, pyqtSignal, QObject, Qt, QEvent, QMimeData, QUrl, QSize, QThreadPool
+from PyQt5.QtCore import pyqtSlot, pyqtProperty, pyqtSignal, QObject, Qt, QEvent, QMimeData, QUrl, QSize, QThreadPool, QRunnable
 from PyQt5.QtQuick import QQuickItem, QQuickPaintedItem
 from PyQt5.QtGui import QImage, QColor, QDrag, QDesktopServices
 from PyQt5.QtQml import qmlRegisterType
@@ -56,6 +56,28 @@ class RemoteStatusMode(Enum):
 def get_id():
     return random.SystemRandom().randint(1, 2**31 - 1)
 
+class ResultDecoderSignals(QObject):
+    done = pyqtSignal(int, int, object)
+
+class ResultDecoder(QRunnable):
+    def __init__(self, id, seq, data):
+        super().__init__()
+        self.id = id
+        self.seq = seq
+        self.data = data
+        self.signals = ResultDecoderSignals()
+
+    def run(self):
+        images = []
+        for d in self.data:
+            if type(d) == bytes or type(d) == bytearray:
+                img = QImage()
+                img.loadFromData(d, "png")
+                images += [img]
+            else:
+                images += [d]
+        self.signals.done.emit(self.id, self.seq, images)
+
 class GUI(QObject):
     statusUpdated = pyqtSignal()
     errorUpdated = pyqtSignal()
@@ -73,7 +95,6 @@ class GUI(QObject):
         super().__init__(parent)
         self.db = sql.Database(self)
         self.watcher = filesystem.Watcher()
-        self.thumbnails = thumbnails.ThumbnailStorage((256,256),(640, 640),75, self)
         
         self.tabs = []
         
@@ -102,11 +123,19 @@ class GUI(QObject):
             "swap": False, "advanced": False, "autocomplete": 1, "vocab": [], "enforce_versions": True,
             "host_enabled": False, "host_address": "127.0.0.1", "host_port": 28888, "host_tunnel": False,
             "host_read_only": True, "host_monitor": False, "tabs": [], "grid_save_all": False,
-            "scaling": False
+            "scaling": False, "thumbnail_memory": 64, "thumbnail_disk": 1024,
+            "output_preview": True, "output_format": "png", "output_compression": -1, "output_optimize": False,
+            "output_webp_method": 4, "upload_chunk_size": 524288, "upload_window": 16, "remote_session_key": False,
+            "request_depth": 2, "pipeline_depth": 2,
+            "remote_reconnect_attempts": 8
         })
         self._config.updated.connect(self.onConfigUpdated)
         self._remoteStatus = RemoteStatusMode.INACTIVE
 
+        memory = int(self._config._values.get("thumbnail_memory"))
+        disk = int(self._config._values.get("thumbnail_disk"))
+        self.thumbnails = thumbnails.ThumbnailStorage((256,256),(640, 640),75, self, "thumbnails.db", memory, disk)
+
         self._modelFolders = []
 
         self._debugJSONLogging = self._config._values.get("debug") == True
@@ -128,16 +157,24 @@ class GUI(QObject):
         self._options = {}
         self._empty = {}
         self._results = {}
+        self._encoded = {}
+        self._decoding = {}
+        self._decodingSeq = 0
+        self._decodingPool = QThreadPool(self)
+
+        self.reset.connect(self.onReset)
 
         parent.aboutToQuit.connect(self.stop)
 
         self.watcher.finished.connect(self.onFolderChanged)
+        self.watcher.folder_changed.connect(self.onFolderUpdated)
 
     @pyqtSlot()
     def stop(self):
         self.aboutToQuit.emit()
         self.backend.wait()
         self.watcher.wait()
+        parameters.saveIndices()
     
     def registerTabs(self, tabs):
         self.tabs = tabs
@@ -270,10 +307,26 @@ class GUI(QObject):
             self._options = self._empty.copy()
         self.optionsUpdated.emit()
     
-    def makeRequest(self, request):
-        id = get_id()
-        request["id"] = id
-        self.backend.makeRequest(request)
+    def outputOptions(self):
+        return {
+            "format": self._config._values.get("output_format"),
+            "compression": int(self._config._values.get("output_compression")),
+            "optimize": self._config._values.get("output_optimize"),
+            "method": int(self._config._values.get("output_webp_method")),
+            "preview": self._config._values.get("output_preview")
+        }
+
+    def requestId(self):
+        return get_id()
+
+    def requestDepth(self):
+        return max(1, int(self._config._values.get("pipeline_depth"))) * self.backend.members()
+
+    def makeRequest(self, request, priority=None, source=None):
+        if not "id" in request:
+            request["id"] = get_id()
+        id = request["id"]
+        self.backend.makeRequest(request, priority, source)
         return id
 
     def cancelRequest(self, id):
@@ -323,6 +376,10 @@ class GUI(QObject):
                     self._remoteStatus = RemoteStatusMode.CONNECTING
                 self._statusMode = StatusMode.STARTING
                 self.watchModelDirectory()
+            elif self._statusText == "Reconnecting":
+                self._remoteStatus = RemoteStatusMode.CONNECTING
+                self._statusProgress = -1.0
+                self._statusMode = StatusMode.STARTING
             elif self._statusText == "Ready" or self._statusText == "Connected":
                 if self._statusText == "Connected":
                     self._remoteStatus = RemoteStatusMode.CONNECTED
@@ -375,7 +432,8 @@ class GUI(QObject):
             
         if type == "aborted":
             self.reset.emit(id)
-            self.setReady()
+            if self.backend.idle():
+                self.setReady()
 
         if type == "progress":
             self._statusProgress = data["current"]/data["total"]
@@ -388,12 +446,11 @@ class GUI(QObject):
 
         if type == "result":
             self.addResult(id, "metadata", data["metadata"])
-            self.addResult(id, "result", data["images"])
+            self.addResult(id, "result", data["images"], True)
             self.setReady()
-            self._results = {}
 
         if type == "annotate":
-            self.addResult(id, "result", data["images"])
+            self.addResult(id, "result", data["images"], True)
             self.setReady()
 
         if type == "artifact":
@@ -405,24 +462,68 @@ class GUI(QObject):
             self.statusUpdated.emit()
 
         if type == "segmentation":
-            self.addResult(id, "result", data["images"])
+            self.addResult(id, "result", data["images"], True)
             self.setReady()
         
         self.response.emit(id, response)
 
-    def addResult(self, id, name, data):
-        if not id in self._results:
-            self._results[id] = {}
-        self._results[id][name] = []
-        for d in data:
-            if type(d) == bytes or type(d) == bytearray:
-                img = QImage()
-                img.loadFromData(d, "png")
-                self._results[id][name] += [img]
-            else:
-                self._results[id][name] += [d]
-        self.result.emit(id, name)
-    
+    def addResult(self, id, name, data, last=False):
+        self._decodingSeq += 1
+        seq = self._decodingSeq
+        if not id in self._decoding:
+            self._decoding[id] = []
+        self._decoding[id] += [[seq, name, None, last, data]]
+
+        if any([type(d) == bytes or type(d) == bytearray for d in data]):
+            decoder = ResultDecoder(id, seq, data)
+            decoder.signals.done.connect(self.onResultDecoded)
+            self._decodingPool.start(decoder)
+        else:
+            self.onResultDecoded(id, seq, list(data))
+
+    @pyqtSlot(int, int, object)
+    def onResultDecoded(self, id, seq, images):
+        pending = self._decoding.get(id, [])
+        for entry in pending:
+            if entry[0] == seq:
+                entry[2] = images
+
+        while pending and pending[0][2] != None:
+            _, name, images, last, data = pending.pop(0)
+            if name == "preview" and any([e[1] == "preview" for e in pending]):
+                continue
+            if not id in self._results:
+                self._results[id] = {}
+            self._results[id][name] = images
+            if name == "result":
+                self._encoded[id] = [bytes(d) if type(d) == bytes or type(d) == bytearray else None for d in data]
+            self.result.emit(id, name)
+            if last and id in self._results:
+                del self._results[id]
+                self._encoded.pop(id, None)
+
+        if not pending and self._decoding.get(id) is pending:
+            del self._decoding[id]
+
+    @pyqtSlot(int)
+    def onReset(self, id):
+        if id == -1:
+            self._decoding = {}
+            self._results = {}
+            self._encoded = {}
+            return
+        if id in self._decoding:
+            del self._decoding[id]
+        if id in self._results:
+            del self._results[id]
+        self._encoded.pop(id, None)
+
+    def encodedResult(self, id, index):
+        encoded = self._encoded.get(id, [])
+        if index < len(encoded):
+            return encoded[index]
+        return None
+
     @pyqtSlot(str, int)
     def onFolderChanged(self, folder, total):
         if folder in self._modelFolders:
@@ -430,6 +531,10 @@ class GUI(QObject):
                 self.refreshModels()
             return
 
+    @pyqtSlot(str, list, list)
+    def onFolderUpdated(self, folder, files, idxs):
+        parameters.observeIndex(folder, files)
+
     @pyqtSlot()
     def refreshModels(self):
         self.wildcards.reload()
@@ -6,55 +6,176 @@ import PIL.Image
 import random
 import copy
 import re
+import collections
 
-from PyQt5.QtCore import pyqtSlot, pyqtProperty, pyqtSignal, QObject, Qt, QSize, QThreadPool, QRect, QMutex, QRunnable, QRectF
+from PyQt5.QtCore import pyqtSlot, pyqtProperty, pyqtSignal, QObject, Qt, QSize, QThreadPool, QRect, QMutex, QMutexLocker, QRunnable, QRectF
 from PyQt5.QtGui import QImage, QPainter, QColor, QFont, QFontMetrics, QTextOption
 
 import parameters
+import thumbnails
+import backend
 from misc import encodeImage
 from tabs.basic.basic_input import BasicInputRole
 
 class OutputWriter(QRunnable):
-    guard = QMutex()
-    def __init__(self, img, metadata, outputs, folder, filename):
+    def __init__(self, img, metadata, outputs, folder, filename, options={}, encoded=None):
         super(OutputWriter, self).__init__()
         self.setAutoDelete(True)
 
-        if not OutputWriter.guard.tryLock(5000):
-            OutputWriter.guard.unlock()
-            OutputWriter.guard.lock()
-
-        m = PIL.PngImagePlugin.PngInfo()
+        self.text = {}
         if metadata:
-            m.add_text("parameters", parameters.formatParameters(metadata))
+            self.text["parameters"] = parameters.formatParameters(metadata)
             recipe = parameters.formatRecipe(metadata)
             if recipe:
-                m.add_text("recipe", recipe)
+                self.text["recipe"] = recipe
 
         folder = os.path.join(outputs, folder)
         os.makedirs(folder, exist_ok=True)
 
         if not filename:
-            idx = parameters.getIndex(folder)
+            idx = parameters.allocateIndex(folder)
             filename = f"{idx:08d}-" + datetime.datetime.now().strftime("%m%d%H%M")
 
+        self.format = "webp" if options.get("format", "png").lower() == "webp" else "png"
+        self.compression = options.get("compression", -1)
+        self.optimize = options.get("optimize", False)
+        self.method = options.get("method", 4)
+        self.preview = options.get("preview", False)
+
         self.img = img
+        self.encoded = encoded
         self.tmp = os.path.join(folder, f"{filename}.tmp")
-        self.file = os.path.join(folder, f"{filename}.png")
-        self.metadata = m
+        self.file = os.path.join(folder, f"{filename}.{self.format}")
+
+    def splice(self):
+        if not self.encoded and type(self.img) == QImage:
+            self.encoded = encodeImage(self.img)
+        if not self.encoded:
+            return None
+        chunks = [thumbnails.make_text_chunk(k, v) for k, v in self.text.items()]
+        if self.preview:
+            if type(self.img) == QImage:
+                preview = thumbnails.get_image_preview(self.img)
+            else:
+                preview = thumbnails.get_preview(self.img)
+            chunks += [thumbnails.make_png_chunk(thumbnails.PREVIEW_CHUNK, preview)]
+        return thumbnails.insert_png_chunks(self.encoded, chunks)
+
+    def save(self):
+        img = self.img
+        if type(img) == QImage:
+            img = thumbnails.image_to_pil(img)
+
+        if self.format == "webp":
+            blob = io.BytesIO()
+            img.save(blob, format="WEBP", lossless=True, method=self.method, exif=thumbnails.make_exif(self.text))
+            data = blob.getvalue()
+            if self.preview:
+                data = thumbnails.insert_webp_chunk(data, thumbnails.PREVIEW_CHUNK, thumbnails.get_preview(img)) or data
+            with open(self.tmp, "wb") as f:
+                f.write(data)
+            return
+
+        m = PIL.PngImagePlugin.PngInfo()
+        for k, v in self.text.items():
+            m.add_text(k, v)
+        if self.preview:
+            m.add(thumbnails.PREVIEW_CHUNK, thumbnails.get_preview(img))
+        level = self.compression if self.compression >= 0 else 6
+        img.save(self.tmp, format="PNG", pnginfo=m, compress_level=level, optimize=self.optimize)
 
     @pyqtSlot()
     def run(self):
-        if type(self.img) == QImage:
-            self.img = encodeImage(self.img)
-
         if type(self.img) == bytes:
+            self.encoded = self.img
             self.img = PIL.Image.open(io.BytesIO(self.img))
 
-        self.img.save(self.tmp, format="PNG", pnginfo=self.metadata)
+        data = None
+        if self.format == "png" and self.compression < 0:
+            data = self.splice()
+
+        if data:
+            with open(self.tmp, "wb") as f:
+                f.write(data)
+        else:
+            self.save()
         os.replace(self.tmp, self.file)
 
-        OutputWriter.guard.unlock()
+class EncodingCache():
+    def __init__(self, budget):
+        self.budget = budget
+        self.total = 0
+        self.entries = collections.OrderedDict()
+        self.guard = QMutex()
+
+    def key(self, img):
+        if type(img) == str:
+            signature = thumbnails.get_signature(img)
+            if not signature:
+                return None
+            return (img,) + signature
+        return img.cacheKey()
+
+    def encode(self, img):
+        key = self.key(img)
+        if key != None:
+            with QMutexLocker(self.guard):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    return self.entries[key]
+
+        if type(img) == str:
+            img = QImage(img)
+        data = encodeImage(img)
+
+        if key != None:
+            with QMutexLocker(self.guard):
+                if not key in self.entries:
+                    self.entries[key] = data
+                    self.total += len(data)
+                while self.total > self.budget and len(self.entries) > 1:
+                    _, old = self.entries.popitem(last=False)
+                    self.total -= len(old)
+        return data
+
+class RequestEncoderSignals(QObject):
+    done = pyqtSignal(int, object)
+
+class RequestEncoder(QRunnable):
+    cache = EncodingCache(128*1024*1024)
+    keys = ["image", "mask", "cn_image", "area"]
+
+    def __init__(self, id, request):
+        super(RequestEncoder, self).__init__()
+        self.id = id
+        self.request = request
+        self.signals = RequestEncoderSignals()
+
+    @staticmethod
+    def pending(value):
+        if type(value) == list:
+            return any([RequestEncoder.pending(v) for v in value])
+        return type(value) == str or type(value) == QImage
+
+    @staticmethod
+    def needed(request):
+        data = request["data"]
+        return any([RequestEncoder.pending(data.get(k, [])) for k in RequestEncoder.keys])
+
+    def encode(self, value):
+        if type(value) == list:
+            return [self.encode(v) for v in value]
+        if type(value) == str or type(value) == QImage:
+            return RequestEncoder.cache.encode(value)
+        return value
+
+    @pyqtSlot()
+    def run(self):
+        data = self.request["data"]
+        for k in RequestEncoder.keys:
+            if k in data:
+                data[k] = self.encode(data[k])
+        self.signals.done.emit(self.id, self.request)
 
 class RequestManager(QObject):
     artifact = pyqtSignal(int, QImage, str)
@@ -71,6 +192,8 @@ class RequestManager(QObject):
         
         self.ids = []
         self.mapping = {}
+        self.encoding = []
+        self.out = 0
 
         self.annotations = {}
 
@@ -83,10 +206,13 @@ class RequestManager(QObject):
 
         self.setGrid(None)
 
+        self.gui.reset.connect(self.onReset)
+
     def setGrid(self, grid, labels = []):
         self.grid = grid
         self.grid_size = None
         self.grid_ids = []
+        self.grid_positions = {}
         self.grid_image = None
         self.grid_images = {}
         self.grid_id = None
@@ -105,8 +231,16 @@ class RequestManager(QObject):
         self.count = len(requests)
 
     def makeRequest(self, request=None):
-        if not request:
+        if request:
+            return self.sendRequest(request)
+        id = None
+        depth = self.gui.requestDepth()
+        while self.requests and len(self.ids) < depth:
             request = self.requests.pop()
+            id = self.sendRequest(request, self.count - len(self.requests) - 1)
+        return id
+
+    def sendRequest(self, request, position=None):
         filename = self.finalizeRequest(request)
 
         folder = ""
@@ -114,12 +248,42 @@ class RequestManager(QObject):
             folder = request["folder"]
             del request["folder"]
 
-        id = self.gui.makeRequest(request)
+        id = self.gui.requestId()
+        request["id"] = id
 
         self.folders[id] = folder or request["type"]
         self.filenames[id] = filename if folder else ""
         self.ids += [id]
+
+        out = max((time.time_ns() // 1000000) % (2**31 - 1), self.out)
+        self.mapping[id] = out
+        self.out = out + int(request["data"].get("batch_size", 1))
+        if self.grid != None and position != None:
+            self.grid_positions[id] = position
+
+        priority = None
+        if request["type"] in {"txt2img", "img2img", "upscale"} and (self.grid != None or self.count > 1):
+            priority = backend.PRIORITY_BULK
+
+        if not self.encoding and not RequestEncoder.needed(request):
+            self.gui.makeRequest(request, priority, self)
+            return id
+
+        self.encoding += [[id, None, priority]]
+        encoder = RequestEncoder(id, request)
+        encoder.signals.done.connect(self.onRequestEncoded)
+        QThreadPool.globalInstance().start(encoder)
         return id
+
+    @pyqtSlot(int, object)
+    def onRequestEncoded(self, id, request):
+        for entry in self.encoding:
+            if entry[0] == id:
+                entry[1] = request
+
+        while self.encoding and self.encoding[0][1]:
+            _, request, priority = self.encoding.pop(0)
+            self.gui.makeRequest(request, priority, self)
     
     def makeAnnotationRequest(self, request, input_id):
         self.setGrid(None)
@@ -127,27 +291,41 @@ class RequestManager(QObject):
         self.annotations[id] = input_id
 
     def cancelRequest(self):
-        if self.ids:
+        self.setRequests([])
+        ids, self.ids = self.ids, []
+        for id in ids:
+            pending = [e for e in self.encoding if e[0] == id]
+            if pending:
+                self.encoding.remove(pending[0])
+            else:
+                self.gui.cancelRequest(id)
+        if ids:
+            self.onRequestEncoded(-1, None)
+
+    @pyqtSlot(int)
+    def onReset(self, id):
+        if id == -1:
+            self.ids = []
+            self.encoding = []
+        elif id in self.ids:
+            self.ids.remove(id)
             self.setRequests([])
-            self.gui.cancelRequest(self.ids.pop())
 
     def finalizeRequest(self, request):
         data = request["data"]
         filename = None
-        for k in ["image", "mask", "cn_image", "area"]:
+        for k in RequestEncoder.keys:
             for i in range(len(data.get(k, []))):
-                if not data[k][i]:
-                    continue
                 if type(data[k][i]) == str:
-                    if not filename:
-                        filename = data[k][i]
-                    data[k][i] = encodeImage(QImage(data[k][i]))
+                    filename = data[k][i]
                 elif type(data[k][i]) == list:
-                    for j in range(len(data[k][i])):
-                        if type(data[k][i][j]) == str:
-                            if not filename:
-                                filename = data[k][i][j]
-                            data[k][i][j] = encodeImage(QImage(data[k][i][j]))
+                    files = [f for f in data[k][i] if type(f) == str]
+                    if files:
+                        filename = files[0]
+                if filename:
+                    break
+            if filename:
+                break
         if filename:
             filename = filename.rsplit(os.path.sep, 1)[-1].rsplit(".", 1)[0]
 
@@ -165,7 +343,7 @@ class RequestManager(QObject):
                 data = []
                 if i._role == BasicInputRole.IMAGE:
                     if i._image and not i._image.isNull():
-                        data += [encodeImage(i._originalCrop or i._original)]
+                        data += [QImage(i._originalCrop or i._original)]
                     if i._files:
                         for f in i._files[::-1]:
                             data += [i.getFilePath(f)]
@@ -175,7 +353,7 @@ class RequestManager(QObject):
                     if i._linked:
                         links[i] = i._linked
                         if i._image and not i._image.isNull():
-                            data += [encodeImage(i._image)]
+                            data += [QImage(i._image)]
                         if i._files:
                             for f in i._files[::-1]:
                                 data += [i.getFilePath(f)]
@@ -186,7 +364,7 @@ class RequestManager(QObject):
                     if i._linked:
                         links[i] = i._linked
                     if i._image and not i._image.isNull():
-                        data += [[encodeImage(a) for a in i.getAreas()]]
+                        data += [i.getAreas()]
                     if data:
                         found[i] = data
                 if i._role == BasicInputRole.CONTROL:
@@ -200,7 +378,7 @@ class RequestManager(QObject):
                     if model == "Inpaint" and i._linked:
                         k = i._linked
                     if k._image and not k._image.isNull():
-                        data += [(model, opts, encodeImage(k._image or k._original))]
+                        data += [(model, opts, QImage(k._image or k._original))]
                     if k._files:
                         for f in k._files[::-1]:
                             data += [(model, opts, k.getFilePath(f))]
@@ -209,7 +387,7 @@ class RequestManager(QObject):
                 if i._role == BasicInputRole.SEGMENTATION:
                     opts = i.getSegmentationArgs()
                     if i._image and not i._image.isNull():
-                        data += [(encodeImage(i._originalCrop or i._original), opts)]
+                        data += [(QImage(i._originalCrop or i._original), opts)]
                     if i._files:
                         for f in i._files[::-1]:
                             data += [(i.getFilePath(f), opts)]
@@ -446,7 +624,8 @@ class RequestManager(QObject):
                 meta = metadata[i] if metadata else None
 
                 folder = self.folders.get(id, "monitor")
-                writer = OutputWriter(result, meta, self.gui.outputDirectory(), folder, None)
+                encoded = self.gui.encodedResult(id, i)
+                writer = OutputWriter(result, meta, self.gui.outputDirectory(), folder, None, self.gui.outputOptions(), encoded)
                 file = writer.file
                 QThreadPool.globalInstance().start(writer)
 
@@ -468,13 +647,11 @@ class RequestManager(QObject):
             return
         
         metadata = available.get("metadata", None)
-        if "metadata" in available and not self.grid_metadata:
+        index = self.grid_positions.get(id, len(self.grid_ids))
+        if "metadata" in available and (not self.grid_metadata or index == 0):
             self.grid_metadata = metadata[0]
-        
-        for i in range(len(images)-1, -1, -1):
-            if not id + i in self.grid_ids:
-                self.grid_ids += [id + i]
-            self.grid_images[id + i] = images[i]
+        for i in range(len(images)):
+            self.grid_images[index + i] = images[i]
 
         x, y = self.grid
         lx, ly = self.grid_labels
@@ -544,26 +721,28 @@ class RequestManager(QObject):
 
         painter = QPainter(self.grid_image)
 
-        id = self.grid_ids[-1]
-        image = self.grid_images[id]
-        px, py = positions[len(self.grid_ids)-1]
-        painter.drawImage(QRect(px,py,w,h), image)
+        for i in range(len(images)):
+            if index + i < len(positions):
+                px, py = positions[index + i]
+                painter.drawImage(QRect(px,py,w,h), images[i])
+        image = images[0]
 
         painter.end()
 
         if name == "result":
             if id in self.ids:
                 self.ids.remove(id)
+            self.grid_ids += [index + i for i in range(len(images)) if not index + i in self.grid_ids]
 
             if self.grid_save_all:
                 folder = self.folders.get(self.grid_id, "grid")
-                writer = OutputWriter(image, metadata[0], self.gui.outputDirectory(), folder, None)
+                writer = OutputWriter(image, metadata[0], self.gui.outputDirectory(), folder, None, self.gui.outputOptions())
                 file = writer.file
                 QThreadPool.globalInstance().start(writer)
 
             if len(self.grid_ids) == cx*cy:
                 folder = self.folders.get(self.grid_id, "grid")
-                writer = OutputWriter(self.grid_image, self.grid_metadata, self.gui.outputDirectory(), folder, None)
+                writer = OutputWriter(self.grid_image, self.grid_metadata, self.gui.outputDirectory(), folder, None, self.gui.outputOptions())
                 file = writer.file
                 QThreadPool.globalInstance().start(writer)
                 self.result.emit(out, self.grid_image, self.grid_metadata, file)
@@ -9,9 +9,11 @@ from typing import cast
 import PIL.Image
 import PIL.PngImagePlugin
 
-from PyQt5.QtCore import pyqtSlot, pyqtProperty, pyqtSignal, QObject, Qt, QVariant, QSize
+from PyQt5.QtCore import pyqtSlot, pyqtProperty, pyqtSignal, QObject, Qt, QVariant, QSize, QMutex, QMutexLocker
 from PyQt5.QtQml import qmlRegisterUncreatableType, qmlRegisterType
 
+import thumbnails
+
 IDX = -1
 
 LABELS = [
@@ -105,8 +107,13 @@ def parseParameters(formatted):
     
     return json
 
-def getParameters(img):
+def getParameters(img, file=None):
     params = img.text("parameters")
+    if not params and file and not file.lower().endswith(".png"):
+        try:
+            params = thumbnails.read_image_info(file)[2].get("parameters", "")
+        except Exception:
+            pass
     if not params and img.text("Description"):
         desc = img.text("Description").replace("(","\\(").replace(")","\\)").replace("{","(").replace("}",")")
         data = json.loads(img.text("Comment"))
@@ -136,15 +143,91 @@ def formatRecipe(metadata):
     
     return json.dumps(recipe)
 
+def parseIndex(filename):
+    try:
+        return int(filename.rsplit(os.path.sep, 1)[-1].split(".")[0].split("-")[0])
+    except Exception:
+        return 0
+
 def getIndex(folder):
-    def get_idx(filename):
+    idx = max([parseIndex(f) for f in os.listdir(folder)] + [0]) + 1
+    return idx
+
+class IndexAllocator():
+    def __init__(self, file):
+        self.file = file
+        self.guard = QMutex()
+        self.counters = {}
+        self.stored = None
+
+    def key(self, folder):
+        return os.path.normcase(os.path.abspath(folder))
+
+    def load(self):
+        self.stored = {}
         try:
-            return int(filename.split(".")[0].split("-")[0])
+            with open(self.file, "r", encoding="utf-8") as f:
+                self.stored = json.load(f)
+        except Exception:
+            pass
+
+    def seed(self, key, folder):
+        if self.stored == None:
+            self.load()
+        try:
+            mtime = os.stat(folder).st_mtime_ns
         except Exception:
             return 0
+        stored = self.stored.get(key, None)
+        if stored and stored[1] == mtime:
+            return stored[0]
+        return getIndex(folder) - 1
+
+    def allocate(self, folder, count=1):
+        key = self.key(folder)
+        with QMutexLocker(self.guard):
+            if not key in self.counters:
+                self.counters[key] = self.seed(key, folder)
+            idx = self.counters[key] + 1
+            self.counters[key] += count
+        return idx
+
+    def observe(self, folder, files):
+        key = self.key(folder)
+        with QMutexLocker(self.guard):
+            if not key in self.counters or not files:
+                return
+            self.counters[key] = max([self.counters[key]] + [parseIndex(f) for f in files])
+
+    def persist(self, keys):
+        if self.stored == None:
+            self.load()
+        for key in keys:
+            try:
+                self.stored[key] = [self.counters[key], os.stat(key).st_mtime_ns]
+            except Exception:
+                self.stored.pop(key, None)
+        try:
+            with open(self.file + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.stored, f)
+            os.replace(self.file + ".tmp", self.file)
+        except Exception:
+            pass
 
-    idx = max([get_idx(f) for f in os.listdir(folder)] + [0]) + 1
-    return idx
+    def save(self):
+        with QMutexLocker(self.guard):
+            self.persist(list(self.counters))
+
+INDEX_ALLOCATOR = IndexAllocator("indices.json")
+
+def allocateIndex(folder, count=1):
+    return INDEX_ALLOCATOR.allocate(folder, count)
+
+def observeIndex(folder, files):
+    INDEX_ALLOCATOR.observe(folder, files)
+
+def saveIndices():
+    INDEX_ALLOCATOR.save()
 
 def getExtent(bound, padding, src, wrk):
     if padding == None or padding < 0:
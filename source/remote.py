@@ -1,6 +1,7 @@
-import queue
+import asyncio
+import threading
 import multiprocessing
-import websockets.sync.client
+import websockets.client
 import websockets.exceptions
 import bson
 import os
@@ -8,18 +9,44 @@ import traceback
 import datetime
 import sys
 import math
+import hashlib
+import struct
+import collections
 
-from PyQt5.QtCore import pyqtSlot, pyqtSignal, QThread
-from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import pyqtSlot, pyqtSignal, QObject, QThread
 
 import secrets
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.exceptions import InvalidTag
 
 DEFAULT_PASSWORD = "qDiffusion"
 FRAGMENT_SIZE = 524288
+UPLOAD_ACK_TIMEOUT = 2.0
+UPLOAD_RETRIES = 3
+SESSION_TIMEOUT = 2.0
+SESSION_INFO = b"qDiffusion session"
+
+POOL_BROADCAST = {"options", "manage", "download", "upload"}
+FINISHED = {"result", "annotate", "segmentation", "error", "aborted"}
+RESUBMIT = {"txt2img", "img2img", "upscale", "annotate", "segmentation"}
+
+RECONNECT_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+SESSION_HEADER = "X-qDiffusion-Session"
+SESSION_SEQ_HEADER = "X-qDiffusion-Session-Seq"
+
+KEY_CACHE = {}
+KEY_CACHE_LOCK = threading.Lock()
+KEY_CACHE_SALT = b"qDiffusion key cache"
+
+FRAMED_MAGIC = b"qdF\x01"
+FRAMED_PART = "__part__"
+FRAME_OBJECT = 0
+FRAME_PART = 1
+FRAME_END = 2
 
 def log_traceback(label):
     exc_type, exc_value, exc_tb = sys.exc_info()
@@ -29,17 +56,33 @@ def log_traceback(label):
     print(label, tb)
     return tb
 
-def get_scheme(password):
+def get_key(password):
     password = password.encode("utf8")
-    h = hashes.Hash(hashes.SHA256())
-    h.update(password)
-    kdf = PBKDF2HMAC(
+    digest = hashlib.sha256(KEY_CACHE_SALT + password).digest()
+    with KEY_CACHE_LOCK:
+        if not digest in KEY_CACHE:
+            h = hashes.Hash(hashes.SHA256())
+            h.update(password)
+            kdf = PBKDF2HMAC(
+                algorithm=hashes.SHA256(),
+                length=32,
+                salt=h.finalize()[:16],
+                iterations=480000,
+            )
+            KEY_CACHE[digest] = kdf.derive(password)
+        return KEY_CACHE[digest]
+
+def get_scheme(password):
+    return AESGCM(get_key(password))
+
+def get_session_scheme(key, client_nonce, host_nonce):
+    hkdf = HKDF(
         algorithm=hashes.SHA256(),
         length=32,
-        salt=h.finalize()[:16],
-        iterations=480000,
+        salt=client_nonce + host_nonce,
+        info=SESSION_INFO,
     )
-    return AESGCM(kdf.derive(password))
+    return AESGCM(hkdf.derive(key))
 
 def encrypt(scheme, obj):
     data = bson.dumps(obj)
@@ -49,165 +92,569 @@ def encrypt(scheme, obj):
     return data
 
 def decrypt(scheme, data):
+    if data[:4] == FRAMED_MAGIC:
+        try:
+            return decrypt_frames(scheme, data)
+        except Exception:
+            pass
     if scheme:
         data = scheme.decrypt(data[:16], data[16:], b"")
     obj = bson.loads(data)
     return obj
 
-class RemoteInferenceUpload(QThread):
-    done = pyqtSignal(str)
-    def __init__(self, queue, type, id, file):
-        super().__init__()
-        self.queue = queue
+def split_parts(obj, parts):
+    if type(obj) == dict:
+        return {k:split_parts(v, parts) for k, v in obj.items()}
+    if type(obj) == list:
+        return [split_parts(v, parts) for v in obj]
+    if (type(obj) == bytes or type(obj) == bytearray) and len(obj) >= FRAGMENT_SIZE:
+        parts += [obj]
+        return {FRAMED_PART: len(parts) - 1}
+    return obj
+
+def join_parts(obj, parts):
+    if type(obj) == dict:
+        if len(obj) == 1 and FRAMED_PART in obj:
+            return bytes(parts[obj[FRAMED_PART]])
+        return {k:join_parts(v, parts) for k, v in obj.items()}
+    if type(obj) == list:
+        return [join_parts(v, parts) for v in obj]
+    return obj
+
+def encrypt_frames(scheme, obj):
+    prefix = secrets.token_bytes(8)
+    yield FRAMED_MAGIC + prefix
+
+    counter = 0
+    def frame(kind, payload):
+        nonlocal counter
+        data = bytes([kind]) + payload
+        if scheme:
+            data = scheme.encrypt(prefix + struct.pack(">I", counter), data, FRAMED_MAGIC)
+        counter += 1
+        return struct.pack(">I", len(data)) + data
+
+    parts = []
+    yield frame(FRAME_OBJECT, bson.dumps(split_parts(obj, parts)))
+    for i, part in enumerate(parts):
+        part = memoryview(part)
+        for j in range(0, len(part), FRAGMENT_SIZE):
+            yield frame(FRAME_PART, struct.pack(">I", i) + part[j:j+FRAGMENT_SIZE])
+    yield frame(FRAME_END, b"")
+
+def decrypt_frames(scheme, data):
+    # websockets delivers the whole message, frames are decrypted in place so only the plaintext parts are
+    # added on top of it, receive memory still grows with the message size
+    data = memoryview(data)
+    prefix = bytes(data[4:12])
+    offset, counter = 12, 0
+    obj, parts = None, []
+    while offset < len(data):
+        length = struct.unpack(">I", data[offset:offset+4])[0]
+        frame = data[offset+4:offset+4+length]
+        offset += 4 + length
+        if scheme:
+            frame = memoryview(scheme.decrypt(prefix + struct.pack(">I", counter), frame, FRAMED_MAGIC))
+        counter += 1
+        kind = frame[0]
+        if kind == FRAME_OBJECT:
+            obj = bson.loads(bytes(frame[1:]))
+        elif kind == FRAME_PART:
+            i = struct.unpack(">I", frame[1:5])[0]
+            while len(parts) <= i:
+                parts += [bytearray()]
+            parts[i] += frame[5:]
+        elif kind == FRAME_END:
+            return join_parts(obj, parts)
+    raise ValueError("Truncated message")
+
+class UploadStalled(Exception):
+    pass
+
+class RemoteInferenceUpload():
+    partial = {}
+    def __init__(self, remote, type, id, file):
+        self.remote = remote
         self.type = type
         self.file = file
         self.id = id
         self.name = file.rsplit(os.path.sep, 1)[-1]
-        self.stopping = False
 
-    def run(self):
+        self.acked = -1
+        self.acknowledged = asyncio.Event()
+
+    def onAck(self, index):
+        self.acked = max(self.acked, index)
+        self.acknowledged.set()
+
+    async def waitAck(self, index):
+        while self.acked < index:
+            self.acknowledged.clear()
+            try:
+                await asyncio.wait_for(self.acknowledged.wait(), UPLOAD_ACK_TIMEOUT)
+            except asyncio.TimeoutError:
+                if self.remote.acks == None:
+                    self.remote.acks = False
+                elif self.remote.acks:
+                    raise UploadStalled()
+            if self.remote.acks == False:
+                return
+
+    def interrupted(self, key, total):
+        if key and self.remote.acks:
+            RemoteInferenceUpload.partial[key] = total
+
+    async def resume(self, key, total):
+        if RemoteInferenceUpload.partial.get(key, None) != total:
+            return 0
+        self.acked = -2
+        await self.remote.send({"type":"chunk", "data": {"type":self.type, "name": self.name, "total": total, "resume": True}, "id":self.id})
+        await self.waitAck(-1)
+        return max(self.acked + 1, 0)
+
+    async def transfer(self, f, key, total):
+        loop = asyncio.get_running_loop()
+        chunk_size, window = self.remote.chunk_size, self.remote.window
+
+        i = start = 0
+        try:
+            i = start = await self.resume(key, total)
+
+            digest = hashlib.sha256()
+            f.seek(0)
+            for _ in range(i):
+                digest.update(await loop.run_in_executor(None, f.read, chunk_size))
+
+            while True:
+                if self.remote.acks != False:
+                    await self.waitAck(i - window)
+                chunk = await loop.run_in_executor(None, f.read, chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                request = {"type":"chunk", "data": {"type":self.type, "name": self.name, "chunk":chunk, "index":i, "total": total, "offset": i*chunk_size}, "id":self.id}
+                await self.remote.send(request)
+                i += 1
+
+            if self.remote.acks != False:
+                await self.waitAck(total - 1)
+        except UploadStalled:
+            raise UploadStalled(max(self.acked, start - 1))
+        return digest
+
+    async def run(self):
+        key, total = None, 0
         try:
             with open(self.file, 'rb') as f:
-                f.seek(0, os.SEEK_END)
-                z = f.tell()
-                f.seek(0)
-                i = 0
-                total = math.ceil(z/FRAGMENT_SIZE)
-                while not self.stopping:
-                    QApplication.processEvents()
-                    chunk = f.read(FRAGMENT_SIZE)
-                    if not chunk:
-                        break
-                    request = {"type":"chunk", "data": {"type":self.type, "name": self.name, "chunk":chunk, "index":i, "total": total}, "id":self.id}
-                    while not self.queue.empty():
-                        QThread.msleep(10)
-                        QApplication.processEvents()
-                        if self.stopping:
-                            break
-                    if self.stopping:
+                stat = os.fstat(f.fileno())
+                z = stat.st_size
+                total = math.ceil(z/self.remote.chunk_size)
+                key = (self.remote.endpoint, self.file, z, stat.st_mtime_ns, self.remote.chunk_size)
+
+                # a host that stops acknowledging is asked where it got to, retries reset whenever it progressed
+                retries, progress = 0, -1
+                while True:
+                    try:
+                        digest = await self.transfer(f, key, total)
                         break
-                    self.queue.put(request)
-                    i += 1
+                    except UploadStalled as e:
+                        self.interrupted(key, total)
+                        acked = e.args[0] if e.args else -1
+                        retries = 0 if acked > progress else retries + 1
+                        progress = max(progress, acked)
+                        if retries >= UPLOAD_RETRIES:
+                            self.remote.onResponse({"type":"error", "id":self.id, "data":{"message":f"Upload of {self.name} stalled"}})
+                            return
+        except asyncio.CancelledError:
+            self.interrupted(key, total)
+            abort = {"type":"chunk", "data": {"type":self.type, "name": self.name, "index":-1}}
+            await asyncio.wait_for(self.remote.send(abort), 0.1)
+            raise
         except Exception:
-            self.done.emit(self.file)
+            self.interrupted(key, total)
             return
-            
-        if self.stopping:
-            self.queue.put({"type":"chunk", "data": {"type":self.type, "name": self.name, "index":-1}})
-        else:
-            self.queue.put({"type":"chunk", "data": {"type":self.type, "name": self.name}})
-        self.done.emit(self.file)
-
-    @pyqtSlot()
-    def stop(self):
-        self.stopping = True
+        await self.remote.send({"type":"chunk", "data": {"type":self.type, "name": self.name, "hash": digest.hexdigest()}})
+        RemoteInferenceUpload.partial.pop(key, None)
 
 class RemoteInference(QThread):
-    kill = pyqtSignal()
     response = pyqtSignal(object)
     def __init__(self, gui, endpoint, password=None):
         super().__init__()
         self.gui = gui
 
         self.stopping = False
-        self.requests = queue.Queue()
-        self.responses = queue.Queue()
         self.endpoint = endpoint
         self.client = None
 
+        self.loop = None
+        self.requests = None
+        self.pending = []
+        self.guard = threading.Lock()
+
         self.scheme = None
         if not password:
             password = DEFAULT_PASSWORD
         self.password = password
+        self.session = bool(gui.config.get("remote_session_key"))
+        self.negotiated = None
+        self.previous = None
+        self.session_id = secrets.token_hex(16)
+        self.seq = 0
+        self.resumable = False
+        self.inflight = {}
+        self.unacked = {}
+        self.finished = collections.deque(maxlen=1024)
+        self.attempts = int(gui.config.get("remote_reconnect_attempts"))
+        self.failures = 0
         self.id = None
         self.uploads = {}
+        self.acks = None
+        self.framed = False
+        self.chunk_size = int(gui.config.get("upload_chunk_size"))
+        self.window = int(gui.config.get("upload_window"))
 
-    def connect(self):
-        if self.client:
-            return
-        self.onResponse({"type": "status", "data": {"message": "Connecting"}})
+    async def connect(self, reconnecting=False):
+        self.onResponse({"type": "status", "data": {"message": "Reconnecting" if reconnecting else "Connecting"}})
+        headers = {SESSION_HEADER: self.session_id, SESSION_SEQ_HEADER: str(self.seq)}
         while not self.client and not self.stopping:
             try:
-                self.client = websockets.sync.client.connect(self.endpoint, open_timeout=2, max_size=None)
-            except TimeoutError:
-                pass
+                self.client = await websockets.client.connect(self.endpoint, open_timeout=2, max_size=None, close_timeout=0.1, extra_headers=headers)
+            except (asyncio.TimeoutError, TimeoutError):
+                if reconnecting:
+                    return
             except ConnectionRefusedError:
-                self.onResponse({"type": "remote_error", "data": {"message": "Connection refused"}})
+                if not reconnecting:
+                    self.onResponse({"type": "remote_error", "data": {"message": "Connection refused"}})
                 return
             except Exception as e:
-                self.onResponse({"type": "remote_error", "data": {"message": str(e)}})
+                if not reconnecting:
+                    self.onResponse({"type": "remote_error", "data": {"message": str(e)}})
                 return
-        if self.stopping:
-            return
         if self.client:
             self.onResponse({"type": "status", "data": {"message": "Connected"}})
-            self.requests.put({"type":"options"})
+            self.requests.put_nowait({"type":"options"})
 
-    def run(self):
-        self.scheme = get_scheme(self.password)
-        self.connect()
-        while self.client and not self.stopping:
+    async def reconnect(self):
+        while not self.client and not self.stopping and self.failures < self.attempts:
+            delay = min(RECONNECT_MAX_DELAY, RECONNECT_DELAY * 2**self.failures)
+            delay *= 0.5 + secrets.randbelow(1000)/1000
+            self.failures += 1
             try:
-                while True:
-                    try:
-                        data = self.client.recv(0)
-                        response = decrypt(self.scheme, data)
-                        self.onResponse(response)
-                        QApplication.processEvents()
-                    except TimeoutError:
-                        break
-                
-                try:
-                    request = self.requests.get(False)
-
-                    if request["type"] == "upload":
-                        file = request["data"]["file"]
-                        if not file in self.uploads:
-                            self.uploads[file] = RemoteInferenceUpload(self.requests, request["data"]["type"], request["id"], file)
-                            self.uploads[file].done.connect(self.onUploadDone)
-                            self.kill.connect(self.uploads[file].stop)
-                            self.uploads[file].start()
-                            
-                        continue
-
-                    data = encrypt(self.scheme, request)
-                    data = [data[i:min(i+FRAGMENT_SIZE,len(data))] for i in range(0, len(data), FRAGMENT_SIZE)]
-
-                    self.client.send(data)
-                    QApplication.processEvents()
-                except queue.Empty:
-                    QThread.msleep(5)
-
-            except websockets.exceptions.ConnectionClosedOK:
-                self.onResponse({"type": "remote_error", "data": {"message": "Connection closed"}})
-                break
-            except Exception as e:
-                if type(e) == InvalidTag or type(e) == IndexError:
-                    self.onResponse({"type": "remote_error", "data": {"message": "Incorrect password"}})
-                else:
-                    self.onResponse({"type": "remote_error", "data": {"message": str(e)}})
-                    log_traceback("REMOTE")
+                await asyncio.wait_for(self.stopped.wait(), delay)
+                return
+            except asyncio.TimeoutError:
+                pass
+            self.scheme = get_scheme(self.password)
+            await self.connect(True)
+
+    async def resubmit(self):
+        requests = self.unacked if self.resumable else self.inflight
+        for request in list(requests.values()):
+            await self.send(request)
+
+    async def send(self, request):
+        if self.framed:
+            await self.client.send(self.frames(request))
+            return
+        data = encrypt(self.scheme, request)
+        data = [data[i:min(i+FRAGMENT_SIZE,len(data))] for i in range(0, len(data), FRAGMENT_SIZE)]
+        await self.client.send(data)
+
+    async def frames(self, request):
+        for frame in encrypt_frames(self.scheme, request):
+            yield frame
+            await asyncio.sleep(0)
+
+    async def negotiate(self):
+        nonce, done = secrets.token_bytes(16), asyncio.Event()
+        self.negotiated = (nonce, done)
+        self.previous = None
+        await self.send({"type":"session", "data":{"nonce": nonce}})
+        try:
+            await asyncio.wait_for(done.wait(), SESSION_TIMEOUT)
+        except asyncio.TimeoutError:
+            # keep going on the password key, a late reply still switches both sides
+            pass
+
+    async def onSession(self, data):
+        if not self.negotiated:
+            return
+        nonce, done = self.negotiated
+        self.negotiated = None
+        # the host stays on the password key until it receives something under the session key,
+        # until then its messages may still arrive under the old one
+        self.previous = self.scheme
+        self.scheme = get_session_scheme(get_key(self.password), nonce, data["nonce"])
+        await self.send({"type":"session", "data":{"confirm": True}})
+        done.set()
+
+    async def sender(self, reconnected):
+        if self.session:
+            await self.negotiate()
+        if reconnected:
+            await self.resubmit()
+        while True:
+            request = await self.requests.get()
+            if request["type"] == "cancel":
+                self.inflight.pop(request["data"]["id"], None)
+                self.unacked.pop(request["data"]["id"], None)
+            if request["type"] in RESUBMIT and "id" in request:
+                self.inflight[request["id"]] = request
+                self.unacked[request["id"]] = request
+            if request["type"] == "upload":
+                file = request["data"]["file"]
+                if not file in self.uploads:
+                    upload = RemoteInferenceUpload(self, request["data"]["type"], request["id"], file)
+                    task = asyncio.create_task(upload.run())
+                    task.add_done_callback(lambda _, file=file: self.uploads.pop(file, None))
+                    self.uploads[file] = (upload, task)
+                continue
+            await self.send(request)
+
+    async def receiver(self):
+        async for data in self.client:
+            if data[:4] == FRAMED_MAGIC:
+                self.framed = True
+            try:
+                response = decrypt(self.scheme, data)
+                self.previous = None
+            except InvalidTag:
+                if not self.previous:
+                    raise
+                response = decrypt(self.previous, data)
+            self.failures = 0
+            if "seq" in response:
+                self.resumable = True
+                if response["seq"] <= self.seq:
+                    continue
+                self.seq = response["seq"]
+            type = response.get("type", "")
+            if type == "ack":
+                self.unacked.pop(response["data"].get("id", None), None)
+            elif type in FINISHED and "id" in response:
+                # a resubmitted request can finish twice if the host had already received it
+                if response["id"] in self.finished:
+                    continue
+                self.finished.append(response["id"])
+                self.inflight.pop(response["id"], None)
+                self.unacked.pop(response["id"], None)
+            if response.get("type", "") == "chunk_ack":
+                self.onAck(response["data"])
+                continue
+            if response.get("type", "") == "session":
+                await self.onSession(response["data"])
+                continue
+            self.onResponse(response)
+
+    def onAck(self, data):
+        self.acks = True
+        for upload, _ in self.uploads.values():
+            if upload.name == data.get("name", None):
+                upload.onAck(data.get("index", -1))
+
+    async def serve(self):
+        self.requests = asyncio.Queue()
+        self.stopped = asyncio.Event()
+        with self.guard:
+            self.loop = asyncio.get_running_loop()
+            for request in self.pending:
+                self.requests.put_nowait(request)
+            self.pending = []
+        if self.stopping:
+            return
+
+        await self.connect()
+        reconnected = False
+        while self.client:
+            message, recoverable = await self.serveConnection(reconnected)
+            if not message or self.stopping:
                 break
+            if recoverable:
+                await self.reconnect()
+                reconnected = True
+                if self.attempts:
+                    message = f"{message} (gave up after {self.failures} reconnect attempts)"
+            if not self.client:
+                self.onResponse({"type": "remote_error", "data": {"message": message}})
 
-        if self.client:
-            self.client.close()
-            self.client = None
+    async def serveConnection(self, reconnected):
+        tasks = [asyncio.create_task(t) for t in [self.sender(reconnected), self.receiver(), self.stopped.wait()]]
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        message, recoverable = None, False
+        try:
+            for task in done:
+                task.result()
+            if tasks[1] in done:
+                raise websockets.exceptions.ConnectionClosedOK(None, None)
+        except websockets.exceptions.ConnectionClosedOK:
+            message, recoverable = "Connection closed", True
+        except (websockets.exceptions.ConnectionClosed, OSError) as e:
+            message, recoverable = str(e), True
+        except Exception as e:
+            if type(e) == InvalidTag or type(e) == IndexError:
+                message = "Incorrect password"
+            else:
+                message = str(e)
+                log_traceback("REMOTE")
+
+        uploads = [(upload, task) for upload, task in self.uploads.values() if not task.done()]
+        for task in tasks + [task for _, task in uploads]:
+            task.cancel()
+        await asyncio.gather(*tasks, *[task for _, task in uploads], return_exceptions=True)
+        if recoverable:
+            for upload, _ in uploads:
+                self.requests.put_nowait({"type":"upload", "id":upload.id, "data":{"type":upload.type, "file":upload.file}})
+
+        await self.client.close()
+        self.client = None
+        return message, recoverable
+
+    def run(self):
+        self.scheme = get_scheme(self.password)
+        asyncio.run(self.serve())
+        with self.guard:
+            self.loop = None
+
+    @pyqtSlot()
+    def stop(self):
+        with self.guard:
+            self.stopping = True
+            if self.loop:
+                self.loop.call_soon_threadsafe(self.stopped.set)
+
+    @pyqtSlot(object)
+    def onRequest(self, request):
+        with self.guard:
+            if self.loop:
+                self.loop.call_soon_threadsafe(self.requests.put_nowait, request)
+            else:
+                self.pending += [request]
+
+    def onResponse(self, response):
+        if not self.stopping:
+            self.response.emit(response)
+
+class RemotePool(QObject):
+    response = pyqtSignal(object)
+    def __init__(self, gui, endpoints, password=None):
+        super().__init__()
+        self.gui = gui
+        self.stopping = False
+        self.members = [RemoteInference(gui, endpoint, password) for endpoint in endpoints]
+        for member in self.members:
+            member.response.connect(self.onMemberResponse)
+
+        self.alive = set(self.members)
+        self.owners = {}
+        self.outstanding = {member:0 for member in self.members}
+        self.queued = {member:None for member in self.members}
+        self.unacked = {member:set() for member in self.members}
+        self.options = {}
+        self.status = None
+
+    def start(self):
+        for member in self.members:
+            member.start()
 
     @pyqtSlot()
     def stop(self):
-        for file in self.uploads:
-            self.uploads[file].stopping = True
         self.stopping = True
+        for member in self.members:
+            member.stop()
+
+    def wait(self, timeout):
+        return all([member.wait(timeout) for member in self.members])
+
+    def terminate(self):
+        for member in self.members:
+            if member.isRunning():
+                member.terminate()
+
+    def load(self, member):
+        # the host reported queue already includes our acked requests, add only those it has not seen yet
+        if self.queued[member] == None:
+            return self.outstanding[member]
+        return self.queued[member] + len(self.unacked[member])
+
+    def select(self):
+        alive = [m for m in self.members if m in self.alive]
+        if not alive:
+            return None
+        return min(alive, key=self.load)
 
     @pyqtSlot(object)
     def onRequest(self, request):
-        self.requests.put(request)
+        type = request.get("type", "")
+        if type == "cancel":
+            owner = self.owners.get(request["data"]["id"], None)
+            targets = [owner] if owner else self.members
+        elif type in POOL_BROADCAST:
+            targets = self.members
+        else:
+            member = self.select()
+            if not member:
+                return
+            targets = [member]
+            if "id" in request:
+                self.owners[request["id"]] = member
+                self.outstanding[member] += 1
+                self.unacked[member].add(request["id"])
+        for member in targets:
+            member.onRequest(request)
+
+    def finish(self, id):
+        owner = self.owners.pop(id, None)
+        if owner:
+            self.outstanding[owner] -= 1
+            self.unacked[owner].discard(id)
+            if self.queued[owner] != None:
+                self.queued[owner] = max(0, self.queued[owner] - 1)
+
+    @pyqtSlot(object)
+    def onMemberResponse(self, response):
+        self.handleMemberResponse(self.sender(), response)
+
+    def handleMemberResponse(self, member, response):
+        id = response.get("id", None)
+        type = response.get("type", "")
+        data = response.get("data", {})
+
+        if type == "ack":
+            self.unacked[member].discard(data.get("id", id))
+            self.queued[member] = data.get("queue", 0)
+        elif type in FINISHED and self.owners.get(id, None) == member:
+            self.finish(id)
+
+        if type == "status":
+            if data.get("message", "") == self.status:
+                return
+            self.status = data.get("message", "")
+        elif type == "options":
+            self.options[member] = data
+            response = {**response, "data": merge_options([self.options[m] for m in self.members if m in self.options])}
+        elif type == "remote_error":
+            self.alive.discard(member)
+            self.options.pop(member, None)
+            for owned in [i for i, m in self.owners.items() if m == member]:
+                self.finish(owned)
+                self.onResponse({"type":"error", "id":owned, "data":{"message": f"{member.endpoint}: {data.get('message', '')}"}})
+            if self.alive:
+                return
+
+        self.onResponse(response)
 
     def onResponse(self, response):
         if not self.stopping:
             self.response.emit(response)
 
-    @pyqtSlot(str)
-    def onUploadDone(self, file):
-        if file in self.uploads:
-            del self.uploads[file]
\ No newline at end of file
+def merge_options(options):
+    merged = {}
+    for o in options:
+        for k, v in o.items():
+            if not k in merged:
+                merged[k] = list(v) if type(v) == list else (dict(v) if type(v) == dict else v)
+            elif type(v) == list and type(merged[k]) == list:
+                merged[k] += [e for e in v if not e in merged[k]]
+            elif type(v) == dict and type(merged[k]) == dict:
+                merged[k] = {**v, **merged[k]}
+    return merged
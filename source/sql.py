@@ -90,6 +90,26 @@ class Connection(QObject):
                 break
         return q
 
+    def doBatch(self, q):
+        self.db.transaction()
+        ctr = 0
+        while not q.execBatch():
+            if ctr > 100:
+                print(q.lastQuery(), "TIMEOUT")
+                break
+            if q.lastError().nativeErrorCode() == "6":
+                QThread.msleep(10)
+                ctr += 1
+                continue
+            else:
+                print(q.lastQuery(), q.lastError().text())
+                break
+        else:
+            if self.db.commit():
+                return True
+        self.db.rollback()
+        return False
+
     @pyqtSlot(str)
     def relayNotification(self, table):
         self.notification.emit(table)
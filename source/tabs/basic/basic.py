@@ -1,4 +1,4 @@
-from PyQt5.QtCore import pyqtProperty, pyqtSlot, pyqtSignal, QObject, QSize, QUrl, QMimeData, QByteArray, QThreadPool, Qt, QRect, QRunnable, QMutex
+from PyQt5.QtCore import pyqtProperty, pyqtSlot, pyqtSignal, QObject, QSize, QUrl, QMimeData, QByteArray, QThreadPool, Qt, QRect
 from PyQt5.QtQml import qmlRegisterSingletonType
 from PyQt5.QtGui import QImage, QDrag, QColor, QPainter
 from PyQt5.QtWidgets import QApplication
@@ -7,12 +7,10 @@ from PyQt5.QtNetwork import QNetworkRequest, QNetworkReply
 
 import parameters
 import re
-from misc import MimeData, encodeImage
+from misc import MimeData
 from canvas.shared import CanvasWrapper
 import sql
 import time
-import io
-import datetime
 import os
 
 # this file is imported at the root
@@ -23,50 +21,8 @@ import misc
 import manager
 import parameters
 
-import PIL.Image
-import PIL.PngImagePlugin
-
 MIME_BASIC_DIVIDER = "application/x-qd-basic-divider"
 
-class BasicImageWriter(QRunnable):
-    guard = QMutex()
-    def __init__(self, img, metadata, outputs, subfolder, filename):
-        super(BasicImageWriter, self).__init__()
-        self.setAutoDelete(True)
-
-        if not BasicImageWriter.guard.tryLock(5000):
-            BasicImageWriter.guard.unlock()
-            BasicImageWriter.guard.lock()
-
-        m = PIL.PngImagePlugin.PngInfo()
-        if metadata:
-            m.add_text("parameters", parameters.formatParameters(metadata))
-
-        folder = os.path.join(outputs, subfolder)
-        os.makedirs(folder, exist_ok=True)
-
-        if not filename:
-            idx = parameters.getIndex(folder)
-            filename = f"{idx:08d}-" + datetime.datetime.now().strftime("%m%d%H%M")
-
-        self.img = img
-        self.tmp = os.path.join(folder, f"{filename}.tmp")
-        self.file = os.path.join(folder, f"{filename}.png")
-        self.metadata = m
-
-    @pyqtSlot()
-    def run(self):
-        if type(self.img) == QImage:
-            self.img = encodeImage(self.img)
-
-        if type(self.img) == bytes:
-            self.img = PIL.Image.open(io.BytesIO(self.img))
-
-        self.img.save(self.tmp, format="PNG", pnginfo=self.metadata)
-        os.replace(self.tmp, self.file)
-
-        BasicImageWriter.guard.unlock()
-
 class Basic(QObject):
     updated = pyqtSignal()
     managersUpdated = pyqtSignal()
@@ -365,7 +321,7 @@ class Basic(QObject):
             if url.isLocalFile():
                 image = QImage(url.toLocalFile())
                 self.pastedImage.emit(image)
-                params = parameters.getParameters(image)
+                params = parameters.getParameters(image, url.toLocalFile())
                 if params:
                     try:
                         seed = parameters.parseParameters(params)["seed"]
@@ -551,7 +507,7 @@ class Basic(QObject):
         if mimedata.hasText():
             self.pastedText.emit(mimedata.text())
 
-        image = None
+        image, file = None, None
         if mimedata.hasImage():
             image = mimedata.imageData()
         
@@ -563,7 +519,8 @@ class Basic(QObject):
 
         for url in urls:
             if url.isLocalFile():
-                image = QImage(url.toLocalFile())
+                file = url.toLocalFile()
+                image = QImage(file)
             elif url.scheme() == "http" or url.scheme() == "https":
                 if url.fileName().rsplit(".")[-1] in {"png", "jpg", "jpeg", "webp", "gif"}:
                     self.download(url, None)
@@ -571,7 +528,7 @@ class Basic(QObject):
 
         if image and not image.isNull():
             self.pastedImage.emit(image)
-            params = parameters.getParameters(image)
+            params = parameters.getParameters(image, file)
             if params:
                 self.pastedText.emit(params)
         
@@ -731,7 +688,7 @@ class Basic(QObject):
         annotator = input._control_settings.get("preprocessor")
         args = input.getControlArgs()
 
-        request = self._parameters.buildAnnotateRequest(annotator, args, encodeImage(input._image))
+        request = self._parameters.buildAnnotateRequest(annotator, args, QImage(input._image))
         self._manager.makeAnnotationRequest(request, input._id)
 
     @pyqtSlot()
@@ -851,7 +851,7 @@ class BasicInput(QObject):
     @pyqtSlot(str)
     def setFolder(self, folder):
         folder = QUrl(folder).toLocalFile()
-        files = glob.glob(os.path.join(folder, "*.png")) + glob.glob(os.path.join(folder, "*.jpg"))
+        files = glob.glob(os.path.join(folder, "*.png")) + glob.glob(os.path.join(folder, "*.jpg")) + glob.glob(os.path.join(folder, "*.webp"))
         files = sortFiles([f.rsplit(os.path.sep)[-1] for f in files])
 
         if files:
@@ -4,10 +4,10 @@ from PyQt5.QtSql import QSqlQuery
 from PyQt5.QtGui import QImage, QDesktopServices, QDrag
 
 import sql
+import filesystem
 import os
 import PIL.Image
 import misc
-import glob
 import shutil
 import time
 import json
@@ -36,17 +36,37 @@ class Populater(QObject):
         self.name = name
         self.conn = None
 
-        self.all_images = []
-        self.all_descs = []
+        self.images = {}
+        self.descs = {}
+        self.sizes = {}
+
+        self.pending = []
+        self.rows = {}
     
     def populateCache(self):
-        self.all_images = []
-        self.all_descs = []
+        self.images = {}
+        self.descs = {}
         folder = self.gui.modelDirectory()
-        for ext in ["*.png", "*.jpg", "*.jpeg"]:
-            self.all_images += glob.glob(os.path.join(folder, os.path.join("**", ext)), recursive=True)
-        for ext in ["*.txt", "*.csv", "*.civitai.info"]:
-            self.all_descs += glob.glob(os.path.join(folder, os.path.join("**", ext)), recursive=True)
+        image_exts = (".png", ".jpg", ".jpeg")
+        desc_exts = (".txt", ".csv", ".civitai.info")
+        for entry in filesystem.scan_folder(folder, image_exts + desc_exts, recursive=True):
+            if os.path.normcase(entry.name).endswith(image_exts):
+                self.images.setdefault(entry.name, []).append(entry.path)
+            else:
+                self.descs.setdefault(entry.name, []).append(entry.path)
+
+    def getSize(self, file):
+        try:
+            mtime = os.stat(file).st_mtime
+        except OSError:
+            return None
+        if not file in self.sizes or self.sizes[file][0] != mtime:
+            try:
+                with PIL.Image.open(file) as img:
+                    self.sizes[file] = (mtime, img.size)
+            except:
+                return None
+        return self.sizes[file][1]
 
     @pyqtSlot()
     def populateOptions(self):
@@ -79,8 +99,6 @@ class Populater(QObject):
         self.gui.setTabWorking(self.name, False)
     
     def setModel(self, name, category, display, type, idx, allow_folder = True):
-        q = QSqlQuery(self.conn.db)
-
         folder = ""
         parts = name.split(os.path.sep)
         if len(parts) > 2 and allow_folder:
@@ -96,17 +114,13 @@ class Populater(QObject):
         possible_images = [file_name + e for e in image_exts] +[file_name_no_ext + e for e in image_exts] 
         for p in possible_images:
             files = [os.path.join(folder_name, p)]
-            files += [i for i in self.all_images if i.endswith(p)]
+            files += self.images.get(p, [])
             for file in files:
-                if not os.path.exists(file):
-                    continue
-                try:
-                    with PIL.Image.open(file) as img:
-                        preview = file
-                        w,h = img.size
-                        break
-                except:
-                    pass
+                size = self.getSize(file)
+                if size:
+                    preview = file
+                    w,h = size
+                    break
             else:
                 continue
             break
@@ -117,7 +131,7 @@ class Populater(QObject):
 
         for p in possible_descs:
             files = [os.path.join(folder_name, p)]
-            files += [i for i in self.all_descs if i.endswith(p)]
+            files += self.descs.get(p, [])
             for file in files:
                 if not os.path.exists(file):
                     continue
@@ -143,25 +157,30 @@ class Populater(QObject):
                 continue
             break
         
-        q.prepare("INSERT OR REPLACE INTO models(name, category, display, type, file, folder, desc, idx, width, height) VALUES (:name, :category, :display, :type, :file, :folder, :desc, :idx, :width, :height);")
-        q.bindValue(":name", name)
-        q.bindValue(":category", category)
-        q.bindValue(":display", display)
-        q.bindValue(":type", type)
-        q.bindValue(":file", preview)
-        q.bindValue(":folder", folder)
-        q.bindValue(":desc", description)
-        q.bindValue(":idx", idx)
-        q.bindValue(":width", w)
-        q.bindValue(":height", h)
-        self.conn.doQuery(q)
+        self.pending += [(name, category, display, type, preview, folder, description, idx, w, h)]
 
     def finishCategory(self, category, total):
-        q = QSqlQuery(self.conn.db)
-        q.prepare("DELETE FROM models WHERE category == :category AND idx >= :total;")
-        q.bindValue(":category", category)
-        q.bindValue(":total", total)
-        self.conn.doQuery(q)
+        rows = [r for r in self.pending if self.rows.get((r[1], r[7])) != r]
+        self.pending = []
+
+        if rows:
+            q = QSqlQuery(self.conn.db)
+            q.prepare("INSERT OR REPLACE INTO models(name, category, display, type, file, folder, desc, idx, width, height) VALUES (:name, :category, :display, :type, :file, :folder, :desc, :idx, :width, :height);")
+            for i, k in enumerate([":name", ":category", ":display", ":type", ":file", ":folder", ":desc", ":idx", ":width", ":height"]):
+                q.bindValue(k, [r[i] for r in rows])
+            if self.conn.doBatch(q):
+                for r in rows:
+                    self.rows[(r[1], r[7])] = r
+
+        stale = [k for k in self.rows if k[0] == category and k[1] >= total]
+        if stale:
+            q = QSqlQuery(self.conn.db)
+            q.prepare("DELETE FROM models WHERE category == :category AND idx >= :total;")
+            q.bindValue(":category", category)
+            q.bindValue(":total", total)
+            self.conn.doQuery(q)
+            for k in stale:
+                del self.rows[k]
 
     def optionsUpdated(self):
         wildcards = self.gui.wildcards._sources
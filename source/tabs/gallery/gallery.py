@@ -1,8 +1,7 @@
-import PIL.Image
 import shutil
 import os
 import send2trash
-import glob
+import sqlite3
 
 from PyQt5.QtCore import pyqtSlot, pyqtSignal, pyqtProperty, QObject, QThread, QUrl, QMimeData, Qt
 from PyQt5.QtSql import QSqlQuery
@@ -11,9 +10,59 @@ from PyQt5.QtGui import QDesktopServices
 from PyQt5.QtWidgets import QApplication
 import sql
 import filesystem
+import thumbnails
 import parameters
 import time
 
+class GalleryIndex():
+    def __init__(self, file):
+        self.db = None
+        try:
+            self.db = sqlite3.connect(file, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL;")
+            self.db.execute("PRAGMA synchronous=NORMAL;")
+            self.db.execute("CREATE TABLE IF NOT EXISTS images(file TEXT PRIMARY KEY, folder TEXT, mtime INTEGER, size INTEGER, width INTEGER, height INTEGER, parameters TEXT);")
+            self.db.execute("CREATE INDEX IF NOT EXISTS images_folder ON images(folder);")
+        except sqlite3.Error:
+            self.db = None
+
+    def get(self, files):
+        found = {}
+        if not self.db or not files:
+            return found
+        try:
+            q = f"SELECT file, mtime, size, width, height, parameters FROM images WHERE file IN ({','.join('?'*len(files))});"
+            for file, mtime, size, width, height, parameters in self.db.execute(q, files):
+                found[file] = ((mtime, size), width, height, parameters)
+        except sqlite3.Error:
+            pass
+        return found
+
+    def put(self, rows):
+        if not self.db or not rows:
+            return
+        try:
+            self.db.executemany("INSERT OR REPLACE INTO images(file, folder, mtime, size, width, height, parameters) VALUES (?, ?, ?, ?, ?, ?, ?);", rows)
+        except sqlite3.Error:
+            pass
+
+    def remove(self, files):
+        if not self.db:
+            return
+        try:
+            self.db.executemany("DELETE FROM images WHERE file = ?;", [(f,) for f in files])
+        except sqlite3.Error:
+            pass
+
+    def prune(self, folder, files):
+        if not self.db:
+            return
+        try:
+            stale = [(f,) for f, in self.db.execute("SELECT file FROM images WHERE folder = ?;", (folder,)) if not f in files]
+            self.db.executemany("DELETE FROM images WHERE file = ?;", stale)
+        except sqlite3.Error:
+            pass
+
 class Populater(QObject):
     forceReload = pyqtSignal(str)
     stop = pyqtSignal(str)
@@ -39,7 +88,9 @@ class Populater(QObject):
         self.folders = set()
         self.working = set()
         self.fresh = set()
+        self.seen = {}
         self.initial = True
+        self.index = None
 
     @pyqtSlot()
     def started(self):
@@ -50,14 +101,23 @@ class Populater(QObject):
         self.conn.enableNotifications("folders")
         self.conn.disableNotifications("images")
 
+        self.index = GalleryIndex("gallery.db")
+
         self.prepareFolders()
 
+        self.watcher.started.connect(self.onStarted)
         self.watcher.finished.connect(self.onFinished)
         self.watcher.folder_changed.connect(self.onResult)
+        self.watcher.folder_removed.connect(self.onRemoved)
         self.watcher.parent_changed.connect(self.onParentChanged)
 
     def prepareFolders(self):
-        subfolders = [s.rsplit(os.path.sep,1)[-1] for s in list(filter(os.path.isdir, glob.glob(self.output + "/*")))]
+        subfolders = []
+        try:
+            with os.scandir(self.output) as it:
+                subfolders = [e.name for e in it if not e.name.startswith(".") and e.is_dir()]
+        except OSError:
+            pass
         subfolders = [o for o in self.order if o in subfolders] + [s for s in subfolders if not s in self.order]
 
         self.primary = ""
@@ -98,11 +158,20 @@ class Populater(QObject):
         if folder == self.output:
             self.prepareFolders()
 
+    @pyqtSlot(str)
+    def onStarted(self, folder):
+        if folder in self.folders:
+            self.seen[folder] = set()
+
     @pyqtSlot(str, int)
     def onFinished(self, folder, total):
         if not folder in self.folders:
             return
 
+        seen = self.seen.pop(folder, set())
+        if len(seen) == total:
+            self.index.prune(folder, seen)
+
         q = QSqlQuery(self.conn.db)
         q.prepare("DELETE FROM images WHERE folder == :folder AND idx >= :total;")
         q.bindValue(":folder", folder)
@@ -119,6 +188,11 @@ class Populater(QObject):
             self.initial = False
             self.resumeFolders()
 
+    @pyqtSlot(str, list)
+    def onRemoved(self, folder, files):
+        if folder in self.folders:
+            self.index.remove(files)
+
     @pyqtSlot(str, list, list)
     def onResult(self, folder, files, idxs):
         if not folder in self.folders:
@@ -129,19 +203,30 @@ class Populater(QObject):
         self.working.add(folder)
 
         data = zip(files, idxs)
-        
+        cached = self.index.get(files)
+        self.seen.setdefault(folder, set()).update(files)
+
         files, folders, idxs, widths, heights, parameters = [], [], [], [], [], []
+        updated = []
         for f, i in data:
-            if not f.split(".")[-1] in {"png"}:
+            if not f.split(".")[-1].lower() in {"png", "webp"}:
                 continue
-            w, h, p = 0, 0, ""
-            try:
-                with PIL.Image.open(f) as img:
-                    if "parameters" in img.info:
-                        p = img.info["parameters"]
-                    w, h = img.size
-            except Exception:
+            signature = thumbnails.get_signature(f)
+            if not signature:
                 continue
+            if f in cached and cached[f][0] == signature:
+                _, w, h, p = cached[f]
+            else:
+                w, h, p = 0, 0, ""
+                try:
+                    info = thumbnails.read_image_info(f)
+                    if not info:
+                        continue
+                    w, h, text, _ = info
+                    p = text.get("parameters", "")
+                except Exception:
+                    continue
+                updated += [(f, folder, *signature, w, h, p)]
             if w == 0 or h == 0:
                 continue
             files += [f]
@@ -151,6 +236,8 @@ class Populater(QObject):
             heights += [h]
             parameters += [p.replace("'", "''")]
 
+        self.index.put(updated)
+
         q = QSqlQuery(self.conn.db)
         q.prepare(f"INSERT OR REPLACE INTO images(file, folder, parameters, idx, width, height) VALUES (:file, :folder, :param, :idx, :width, :height);")
         q.bindValue(":file", files)
@@ -216,17 +303,19 @@ class Gallery(QObject):
 
     @pyqtSlot(str, list)
     def doCopy(self, folder, files):
-        idx = parameters.getIndex(folder)
+        idx = parameters.allocateIndex(folder, len(files))
         for src in files:
-            dst = os.path.join(folder, f"{idx:07d}.png")
+            ext = src.rsplit(".", 1)[-1]
+            dst = os.path.join(folder, f"{idx:07d}.{ext}")
             shutil.copy(src, dst)
             idx += 1
 
     @pyqtSlot(str, list)
     def doMove(self, folder, files):
-        idx = parameters.getIndex(folder)
+        idx = parameters.allocateIndex(folder, len(files))
         for src in files:
-            dst = os.path.join(folder, f"{idx:07d}.png")
+            ext = src.rsplit(".", 1)[-1]
+            dst = os.path.join(folder, f"{idx:07d}.{ext}")
             shutil.move(src, dst)
             idx += 1
 
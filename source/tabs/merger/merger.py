@@ -10,12 +10,21 @@ import sql
 import misc
 from tabs.basic.basic_output import BasicOutput
 import manager
+import thumbnails
 
 from PyQt5.QtCore import pyqtProperty, pyqtSignal, QObject, pyqtSlot, QUrl, QThread, QThreadPool
 from PyQt5.QtQml import qmlRegisterSingletonType, qmlRegisterUncreatableType
 from PyQt5.QtSql import QSqlQuery
 from PyQt5.QtGui import QImage
 
+def readRecipe(file):
+    if file.lower().endswith(".png"):
+        return QImage(file).text("recipe")
+    try:
+        return thumbnails.read_image_info(file)[2].get("recipe", "")
+    except Exception:
+        return ""
+
 class MergeOperation(QObject):
     updated = pyqtSignal()
     def __init__(self, parent=None):
@@ -460,9 +469,8 @@ class Merger(QObject):
             else:
                 model_type = recipe["type"]
                 operations = recipe["operations"]
-        elif file.endswith(".png"):
-            image = QImage(file)
-            recipe = image.text("recipe")
+        else:
+            recipe = readRecipe(file)
             if not recipe:
                 return
             recipe = json.loads(recipe)
@@ -471,8 +479,6 @@ class Merger(QObject):
             strength = recipe.get("strength", None)
             if strength != None:
                 self._parameters.set("strength", strength)
-        else:
-            return
 
         self._parameters.set("type", model_type)
         
@@ -0,0 +1,13 @@
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PyQt5.QtGui import QGuiApplication
+
+@pytest.fixture(scope="session")
+def app():
+    app = QGuiApplication.instance() or QGuiApplication(["tests"])
+    yield app
@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import random
+
+import websockets.server
+
+from PyQt5.QtCore import pyqtSignal, QObject
+
+import remote
+
+PASSWORD = "pw"
+
+CONFIG = {
+    "request_depth": 2, "pipeline_depth": 2, "upload_chunk_size": 524288, "upload_window": 16,
+    "remote_session_key": False, "remote_reconnect_attempts": 8
+}
+
+class FakeGui(QObject):
+    aboutToQuit = pyqtSignal()
+    reset = pyqtSignal(int)
+    _debugJSONLogging = False
+
+    def __init__(self, **config):
+        super().__init__()
+        self.config = {**CONFIG, **config}
+        self.backend = None
+        self.cancelled = []
+
+    def requestId(self):
+        return random.SystemRandom().randint(1, 2**31 - 1)
+
+    def requestDepth(self):
+        members = self.backend.members() if self.backend else 1
+        return self.config["pipeline_depth"] * members
+
+    def makeRequest(self, request, priority=None, source=None):
+        if self.backend:
+            self.backend.makeRequest(request, priority, source)
+        return request["id"]
+
+    def cancelRequest(self, id):
+        self.cancelled += [id]
+
+def run_until(app, predicate, timeout=10.0):
+    end = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > end:
+            return False
+        app.processEvents()
+        time.sleep(0.005)
+    return True
+
+class StubHost():
+    # a minimal sd-inference-server stand-in, generation requests are processed one at a time
+    def __init__(self, cost=0.05, replay=False, sessions=True, payload=b"x", lose_ack=None, stall=None, chunk_acks=True, recover=True, framed=False, session_delay=None):
+        self.cost = cost
+        self.replay = replay
+        self.sessions_enabled = sessions
+        self.payload = payload
+        self.lose_ack = lose_ack
+        self.stall = stall
+        self.chunk_acks = chunk_acks
+        self.recover = recover
+        self.framed = framed
+        self.session_delay = session_delay
+        self.schemes = {}
+        self.keys = []
+        self.magic = []
+        self.chunks = {}
+        self.uploaded = {}
+        self.port = None
+        self.loop = None
+        self.sessions = {}
+        self.connections = set()
+        self.received = []
+        self.results = []
+        self.drops = 0
+
+    def start(self):
+        ready = threading.Event()
+        threading.Thread(target=self.serve, args=(ready,), daemon=True).start()
+        ready.wait()
+        return f"ws://127.0.0.1:{self.port}"
+
+    def serve(self, ready):
+        async def main():
+            self.loop = asyncio.get_running_loop()
+            self.work = asyncio.Queue()
+            self.running = 0
+            self.server = await websockets.server.serve(self.handler, "127.0.0.1", 0, max_size=None)
+            self.port = self.server.sockets[0].getsockname()[1]
+            self.worker = asyncio.create_task(self.process())
+            ready.set()
+            await asyncio.Future()
+        asyncio.run(main())
+
+    def drop(self):
+        def abort():
+            self.drops += 1
+            for ws in list(self.connections):
+                ws.transport.abort()
+        self.loop.call_soon_threadsafe(abort)
+
+    def stop(self):
+        def close():
+            self.server.close()
+            for ws in list(self.connections):
+                ws.transport.abort()
+        self.loop.call_soon_threadsafe(close)
+
+    def scheme(self, ws=None):
+        return self.schemes.get(ws, {}).get("current", None) or remote.get_scheme(PASSWORD)
+
+    def encrypt(self, response, ws=None):
+        if self.framed:
+            return b"".join(remote.encrypt_frames(self.scheme(ws), response))
+        return remote.encrypt(self.scheme(ws), response)
+
+    def decrypt(self, ws, data):
+        schemes = self.schemes.setdefault(ws, {"current": None, "pending": None})
+        if schemes["pending"]:
+            try:
+                request = remote.decrypt(schemes["pending"], data)
+                # anything under the session key confirms it
+                schemes["current"], schemes["pending"] = schemes["pending"], None
+                self.keys += ["session"]
+                return request
+            except remote.InvalidTag:
+                pass
+        request = remote.decrypt(self.scheme(ws), data)
+        self.keys += ["session" if schemes["current"] else "password"]
+        return request
+
+    async def negotiate(self, ws, nonce):
+        await asyncio.sleep(self.session_delay)
+        host = os.urandom(16)
+        await ws.send(self.encrypt({"type":"session", "data":{"nonce":host}}, ws))
+        self.schemes[ws]["pending"] = remote.get_session_scheme(remote.get_key(PASSWORD), nonce, host)
+
+    async def emit(self, session, response, ws=None):
+        if self.replay:
+            session["seq"] += 1
+            response = {**response, "seq": session["seq"]}
+            session["outbox"] += [response]
+        ws = ws or session["ws"]
+        if not ws:
+            return
+        try:
+            await ws.send(self.encrypt(response, ws))
+        except Exception:
+            pass
+
+    async def process(self):
+        while True:
+            session, request = await self.work.get()
+            self.running = 1
+            await asyncio.sleep(self.cost)
+            self.running = 0
+            if not self.replay and session["ws"] == None:
+                # without replay the results of a disconnected client are lost
+                continue
+            if request["id"] in session["cancelled"]:
+                await self.emit(session, {"type":"aborted", "id":request["id"], "data":{}})
+                continue
+            self.results += [request["id"]]
+            images = request["data"].get("images", [self.payload])
+            await self.emit(session, {"type":"result", "id":request["id"], "data":{"images":images, "metadata":[{"port":self.port}]}})
+
+    async def handler(self, ws):
+        key = str(id(ws))
+        if self.sessions_enabled:
+            key = ws.request_headers.get(remote.SESSION_HEADER, key)
+        last = int(ws.request_headers.get(remote.SESSION_SEQ_HEADER, "0"))
+        if not key in self.sessions:
+            self.sessions[key] = {"seq": 0, "outbox": [], "ws": None, "cancelled": set()}
+        session = self.sessions[key]
+        session["ws"] = ws
+        self.connections.add(ws)
+        try:
+            for response in [r for r in session["outbox"] if r["seq"] > last]:
+                await ws.send(self.encrypt(response, ws))
+            async for data in ws:
+                self.magic += [data[:4]]
+                request = self.decrypt(ws, data)
+                self.received += [request]
+                await self.handle(session, ws, request)
+        except Exception:
+            pass
+        finally:
+            self.connections.discard(ws)
+            self.schemes.pop(ws, None)
+            if session["ws"] is ws:
+                session["ws"] = None
+
+    async def handle(self, session, ws, request):
+        type = request["type"]
+        if type == "options":
+            await self.emit(session, {"type":"options", "data":{"SD":[f"model{self.port}.safetensors", "shared.safetensors"]}}, ws)
+        elif type == "cancel":
+            session["cancelled"].add(request["data"]["id"])
+        elif type in remote.RESUBMIT:
+            self.work.put_nowait((session, request))
+            if self.lose_ack == request["id"]:
+                # the request arrived but the connection dies before it is acknowledged
+                self.lose_ack = None
+                ws.transport.abort()
+                return
+            queue = self.work.qsize() + self.running
+            await self.emit(session, {"type":"ack", "id":request["id"], "data":{"id":request["id"], "queue":queue}}, ws)
+        elif type == "chunk":
+            await self.chunk(ws, request["data"])
+        elif type == "session" and self.session_delay != None and "nonce" in request["data"]:
+            asyncio.create_task(self.negotiate(ws, request["data"]["nonce"]))
+
+    async def chunk(self, ws, data):
+        name = data["name"]
+        chunks = self.chunks.setdefault(name, {})
+        if "hash" in data:
+            received = b"".join([chunks[i] for i in sorted(chunks)])
+            self.uploaded[name] = hashlib.sha256(received).hexdigest() == data["hash"]
+            return
+        if data.get("resume", False):
+            # a stalled host comes back once the client asks where it got to
+            if not self.recover:
+                return
+            self.stall = None
+            index = -1
+            while index + 1 in chunks:
+                index += 1
+        else:
+            index = data["index"]
+            if index == -1:
+                return
+            chunks[index] = data["chunk"]
+            if not self.chunk_acks or (self.stall != None and len(chunks) > self.stall):
+                return
+        await ws.send(self.encrypt({"type":"chunk_ack", "data":{"name":name, "index":index}}, ws))
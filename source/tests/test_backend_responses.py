@@ -0,0 +1,28 @@
+import backend
+
+FOREIGN = backend.INV_SEP.join(["models", "SD", "a.safetensors"])
+LOCAL = backend.SEP.join(["models", "SD", "a.safetensors"])
+
+def test_summarize_bytes():
+    data = {"images":[b"x"*10, bytearray(3)], "prompt":"a", "seed":1, "scale":7.5, "tiling":False, "mask":None, "size":(1, 2), "subseed":(5, 0.5), "controls":[(b"x", "canny")], "other":object()}
+    assert backend.summarizeBytes(data) == {
+        "images":["<10 bytes>", "<3 bytes>"], "prompt":"a", "seed":1, "scale":7.5, "tiling":False, "mask":None, "size":[1, 2], "subseed":[5, 0.5],
+        "controls":[["<1 bytes>", "canny"]], "other":"<object>"
+    }
+
+def test_only_path_fields_are_converted():
+    response = {"type":"result", "data":{"images":[FOREIGN.encode()], "metadata":[{"model":FOREIGN, "prompt":FOREIGN}], "other":FOREIGN}}
+    backend.convert_response_paths(response)
+    assert response["data"]["metadata"] == [{"model":LOCAL, "prompt":FOREIGN}]
+    assert response["data"]["other"] == FOREIGN
+    assert response["data"]["images"] == [FOREIGN.encode()]
+
+    for type in ["progress", "error", "status"]:
+        response = {"type":type, "data":{"message":FOREIGN, "model":FOREIGN}}
+        backend.convert_response_paths(response)
+        assert response["data"] == {"message":FOREIGN, "model":FOREIGN}
+
+def test_unknown_types_convert_everything_but_text():
+    response = {"type":"options", "data":{"SD":[FOREIGN], "prompt":FOREIGN, "nested":{"vae":FOREIGN}}}
+    backend.convert_response_paths(response)
+    assert response["data"] == {"SD":[LOCAL], "prompt":FOREIGN, "nested":{"vae":LOCAL}}
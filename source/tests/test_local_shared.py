@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import queue
+from multiprocessing import shared_memory
+
+import pytest
+
+import local
+
+def pools():
+    a, b = queue.Queue(), queue.Queue()
+    return local.SharedPool(a, b), local.SharedPool(b, a)
+
+def names(obj):
+    if type(obj) == dict:
+        return sum([names(v) for v in obj.values()], [])
+    if type(obj) == list:
+        return sum([names(v) for v in obj], [])
+    if type(obj) == local.SharedBytes:
+        return [obj.name]
+    return []
+
+def test_png_sized_payloads_are_shared():
+    sender, receiver = pools()
+    request = {"type":"img2img", "data":{"image":[os.urandom(local.SHARED_THRESHOLD)], "mask":[os.urandom(100)]}}
+    shared = sender.share(request)
+    assert type(shared["data"]["image"][0]) == local.SharedBytes
+    assert shared["data"]["mask"] == request["data"]["mask"]
+    assert receiver.unshare(shared) == request
+    receiver.close()
+    sender.close()
+
+def test_segments_are_reused_and_unlinked_on_close():
+    sender, receiver = pools()
+    seen = set()
+    for _ in range(4):
+        request = {"type":"img2img", "data":{"image":[os.urandom(2*1024*1024)]}}
+        shared = sender.share(request)
+        seen.update(names(shared))
+        assert receiver.unshare(shared) == request
+    # each segment was handed back before the next request, so one is enough
+    assert len(seen) == 1
+
+    receiver.close()
+    sender.close()
+    for name in seen:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+def echo(requests, responses, returns):
+    pool = local.SharedPool(*returns)
+    request = pool.unshare(requests.get())
+    responses.put(pool.share({"type":"result", "data":{"images":request["data"]["image"][::-1]}}))
+    requests.get()
+    pool.close()
+
+def test_round_trip_through_process():
+    requests, responses = multiprocessing.Queue(16), multiprocessing.Queue(16)
+    returns = (multiprocessing.Queue(), multiprocessing.Queue())
+    process = multiprocessing.Process(target=echo, args=(requests, responses, returns[::-1]))
+    process.start()
+    pool = local.SharedPool(*returns)
+
+    images = [os.urandom(3*1024*1024), os.urandom(1024*1024)]
+    requests.put(pool.share({"type":"img2img", "data":{"image":images}}))
+    response = responses.get(timeout=10)
+    child = names(response)
+    assert len(child) == 2
+    assert pool.unshare(response)["data"]["images"] == images[::-1]
+
+    requests.put(None)
+    process.join(10)
+    owned = list(pool.owned)
+    pool.close()
+    for name in owned + child:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
@@ -0,0 +1,18 @@
+import json
+
+import PIL.Image
+
+import manager
+import parameters
+from tabs.merger import merger
+
+def test_recipe_round_trip(app, tmp_path):
+    operations = [{"operation":"Weighted Sum", "model_a":"a.safetensors", "model_b":"b.safetensors", "alpha":0.5}]
+    recipe = parameters.formatRecipe({"merge_checkpoint_recipe": operations})
+    image = PIL.Image.new("RGB", (64, 64))
+    for format in ["png", "webp"]:
+        writer = manager.OutputWriter(image, None, str(tmp_path), "", format, {"format":format})
+        writer.text["recipe"] = recipe
+        writer.run()
+        loaded = merger.readRecipe(str(tmp_path / f"{format}.{format}"))
+        assert json.loads(loaded) == {"type":"Checkpoint", "operations":operations}
@@ -0,0 +1,56 @@
+import os
+import threading
+
+import parameters
+
+def test_concurrent_allocations_do_not_overlap(tmp_path):
+    folder = tmp_path / "outputs"
+    folder.mkdir()
+    (folder / "00000041-01011200.png").write_bytes(b"")
+    sidecar = str(tmp_path / "indices.json")
+    allocator = parameters.IndexAllocator(sidecar)
+
+    ranges = []
+    def allocate(count):
+        for _ in range(50):
+            idx = allocator.allocate(str(folder), count)
+            ranges.append((idx, count))
+    threads = [threading.Thread(target=allocate, args=(n,)) for n in [1, 2, 3, 4]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    indices = sorted([i for idx, count in ranges for i in range(idx, idx + count)])
+    assert indices == list(range(42, 42 + 50 * (1 + 2 + 3 + 4)))
+
+    # nothing is written until the save at stop, a restart then continues where it left off
+    assert not os.path.exists(sidecar)
+    allocator.save()
+    assert parameters.IndexAllocator(sidecar).allocate(str(folder)) == indices[-1] + 1
+
+def test_changed_folder_is_rescanned(tmp_path):
+    folder = tmp_path / "outputs"
+    folder.mkdir()
+    sidecar = str(tmp_path / "indices.json")
+    allocator = parameters.IndexAllocator(sidecar)
+    assert allocator.allocate(str(folder), 5) == 1
+    allocator.save()
+
+    (folder / "00000100-01011200.png").write_bytes(b"")
+    os.utime(folder, ns=(0, os.stat(folder).st_mtime_ns + 10**9))
+    assert parameters.IndexAllocator(sidecar).allocate(str(folder)) == 101
+
+def test_unsaved_allocations_are_rescanned_after_a_crash(tmp_path):
+    folder = tmp_path / "outputs"
+    folder.mkdir()
+    sidecar = str(tmp_path / "indices.json")
+    allocator = parameters.IndexAllocator(sidecar)
+    allocator.allocate(str(folder))
+    allocator.save()
+
+    # the next session writes outputs but never reaches its save
+    idx = parameters.IndexAllocator(sidecar).allocate(str(folder))
+    (folder / f"{idx:08d}-01011200.png").write_bytes(b"")
+    os.utime(folder, ns=(0, os.stat(folder).st_mtime_ns + 10**9))
+    assert parameters.IndexAllocator(sidecar).allocate(str(folder)) == idx + 1
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+import backend
+import remote
+
+from stubs import FakeGui, StubHost, PASSWORD, run_until
+
+def connect(app, host):
+    gui = FakeGui()
+    b = backend.Backend(gui)
+    responses = []
+    b.response.connect(responses.append)
+    b.setEndpoint(host.start(), PASSWORD)
+    assert run_until(app, lambda: any([r["type"] == "options" for r in responses]))
+    return b, responses
+
+def round_trip(app, framed):
+    host = StubHost(framed=framed)
+    b, responses = connect(app, host)
+    images = [os.urandom(3*remote.FRAGMENT_SIZE + 17), os.urandom(100)]
+    b.makeRequest({"type":"img2img", "id":1, "data":{"images":images}})
+    assert run_until(app, lambda: any([r["type"] == "result" for r in responses]))
+    result = [r for r in responses if r["type"] == "result"][0]
+    b.stop()
+    b.wait()
+    return host, images, result
+
+def test_framed_round_trip(app):
+    host, images, result = round_trip(app, True)
+    assert result["data"]["images"] == images
+    # the client switches to frames once the host has sent one
+    assert host.magic[-1] == remote.FRAMED_MAGIC
+
+def test_legacy_round_trip(app):
+    host, images, result = round_trip(app, False)
+    assert result["data"]["images"] == images
+    assert not remote.FRAMED_MAGIC in host.magic
+
+def test_frames_are_authenticated():
+    scheme = remote.get_scheme(PASSWORD)
+    obj = {"type":"result", "data":{"images":[os.urandom(2*remote.FRAGMENT_SIZE)]}}
+    frames = list(remote.encrypt_frames(scheme, obj))
+    assert remote.decrypt_frames(scheme, b"".join(frames)) == obj
+
+    swapped = frames[:2] + [frames[3], frames[2]] + frames[4:]
+    with pytest.raises(remote.InvalidTag):
+        remote.decrypt_frames(scheme, b"".join(swapped))
+    with pytest.raises(ValueError):
+        remote.decrypt_frames(scheme, b"".join(frames[:-1]))
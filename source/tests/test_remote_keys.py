@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+import remote
+
+@pytest.fixture
+def derivations(monkeypatch):
+    calls = []
+    kdf = remote.PBKDF2HMAC
+    def counted(*args, **kwargs):
+        calls.append(kwargs["salt"])
+        return kdf(*args, **kwargs)
+    monkeypatch.setattr(remote, "PBKDF2HMAC", counted)
+    monkeypatch.setattr(remote, "KEY_CACHE", {})
+    return calls
+
+def test_key_is_derived_once_per_password(derivations):
+    a = remote.get_key("hunter2")
+    assert remote.get_key("hunter2") == a
+    assert len(derivations) == 1
+
+    b = remote.get_key("hunter3")
+    assert b != a and len(b) == 32
+    # the salt follows the password, so a different password also means a different salt
+    assert len(derivations) == 2 and derivations[0] != derivations[1]
+
+def test_cache_does_not_hold_passwords(derivations):
+    remote.get_key("hunter2")
+    assert not any([b"hunter2" in k for k in remote.KEY_CACHE])
+
+def test_session_scheme_agrees_on_both_sides():
+    key = remote.get_key(remote.DEFAULT_PASSWORD)
+    client, host = os.urandom(16), os.urandom(16)
+    message = {"type":"txt2img", "data":{"prompt":"a"}}
+
+    data = remote.encrypt(remote.get_session_scheme(key, client, host), message)
+    assert remote.decrypt(remote.get_session_scheme(key, client, host), data) == message
+
+    for other in [remote.get_session_scheme(key, client, os.urandom(16)), remote.get_scheme(remote.DEFAULT_PASSWORD)]:
+        with pytest.raises(remote.InvalidTag):
+            remote.decrypt(other, data)
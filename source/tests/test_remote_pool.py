@@ -0,0 +1,92 @@
+import remote
+import backend
+
+from stubs import FakeGui, StubHost, PASSWORD, run_until
+
+def make_pool(app, hosts, **config):
+    gui = FakeGui(**config)
+    b = backend.Backend(gui)
+    gui.backend = b
+    responses = []
+    b.response.connect(responses.append)
+    b.setEndpoint(",".join([h.start() for h in hosts]), PASSWORD)
+    return gui, b, responses
+
+def results(responses):
+    return [r for r in responses if r["type"] == "result"]
+
+def test_pool_spreads_requests_across_hosts(app):
+    hosts = [StubHost(cost=0.1) for _ in range(3)]
+    gui, b, responses = make_pool(app, hosts)
+    assert b.members() == 3
+    assert run_until(app, lambda: any([r["type"] == "options" for r in responses]))
+
+    for i in range(12):
+        b.makeRequest({"type":"txt2img", "id":100+i, "data":{}})
+    assert run_until(app, lambda: len(results(responses)) == 12)
+
+    ids = [r["id"] for r in results(responses)]
+    assert sorted(ids) == list(range(100, 112))
+    assert [len(h.results) for h in hosts] == [4, 4, 4]
+
+    b.makeRequest({"type":"options"})
+    assert run_until(app, lambda: len(responses[-1]["data"].get("SD", [])) == 4 if responses[-1]["type"] == "options" else False)
+    b.stop()
+    b.wait()
+
+def test_pool_skips_refused_endpoint(app):
+    hosts = [StubHost(cost=0.05) for _ in range(2)]
+    gui = FakeGui()
+    b = backend.Backend(gui)
+    responses = []
+    b.response.connect(responses.append)
+    b.setEndpoint(",".join([h.start() for h in hosts] + ["ws://127.0.0.1:1"]), PASSWORD)
+    assert run_until(app, lambda: len(b.inference.alive) == 2)
+
+    for i in range(6):
+        b.makeRequest({"type":"txt2img", "id":200+i, "data":{}})
+    assert run_until(app, lambda: len(results(responses)) == 6)
+    assert not any([r["type"] == "remote_error" for r in responses])
+    b.stop()
+    b.wait()
+
+def test_pool_load_counts_acked_requests_once(app):
+    pool = remote.RemotePool(FakeGui(), ["ws://a", "ws://b"])
+    a, b = pool.members
+    sent = []
+    for member in pool.members:
+        member.onRequest = lambda request, member=member: sent.append((member, request["id"]))
+
+    pool.onRequest({"type":"txt2img", "id":1, "data":{}})
+    assert sent[-1] == (a, 1)
+    assert pool.load(a) == 1
+
+    # the host queue depth includes the acked request, it must not be counted twice
+    pool.handleMemberResponse(a, {"type":"ack", "id":1, "data":{"id":1, "queue":1}})
+    assert pool.load(a) == 1
+
+    pool.onRequest({"type":"txt2img", "id":2, "data":{}})
+    assert sent[-1] == (b, 2)
+
+    # a busy host reported by its ack is avoided even with nothing outstanding from us
+    pool.handleMemberResponse(b, {"type":"ack", "id":2, "data":{"id":2, "queue":5}})
+    pool.onRequest({"type":"txt2img", "id":3, "data":{}})
+    assert sent[-1] == (a, 3)
+
+    pool.handleMemberResponse(a, {"type":"result", "id":1, "data":{}})
+    pool.handleMemberResponse(a, {"type":"result", "id":3, "data":{}})
+    assert pool.load(a) == 0
+
+def test_manager_depth_scales_with_pool(app):
+    import manager
+    gui = FakeGui(pipeline_depth=2)
+    class Pool:
+        def members(self):
+            return 3
+        def makeRequest(self, request, priority=None, source=None):
+            pass
+    gui.backend = Pool()
+    m = manager.RequestManager(gui)
+    m.setRequests([{"type":"txt2img", "data":{}} for _ in range(10)])
+    m.makeRequest()
+    assert len(m.ids) == 6
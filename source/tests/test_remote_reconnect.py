@@ -0,0 +1,87 @@
+import backend
+
+from stubs import FakeGui, StubHost, PASSWORD, run_until
+
+def connect(app, host, **config):
+    gui = FakeGui(request_depth=8, **config)
+    b = backend.Backend(gui)
+    responses = []
+    b.response.connect(responses.append)
+    b.setEndpoint(host.start(), PASSWORD)
+    assert run_until(app, lambda: any([r["type"] == "options" for r in responses]))
+    return b, responses
+
+def result_ids(responses):
+    return [r["id"] for r in responses if r["type"] == "result"]
+
+def statuses(responses):
+    return [r["data"]["message"] for r in responses if r["type"] == "status"]
+
+def submit(b, ids):
+    for id in ids:
+        b.makeRequest({"type":"txt2img", "id":id, "data":{}})
+
+def test_replaying_host_resumes_after_drop(app):
+    host = StubHost(cost=0.2, replay=True)
+    b, responses = connect(app, host)
+    submit(b, range(1, 5))
+    assert run_until(app, lambda: len([r for r in responses if r["type"] == "ack"]) == 4)
+
+    host.drop()
+    assert run_until(app, lambda: len(set(result_ids(responses))) == 4)
+    assert run_until(app, lambda: len(host.results) == 4)
+    app.processEvents()
+
+    assert sorted(result_ids(responses)) == [1, 2, 3, 4]
+    assert "Reconnecting" in statuses(responses)
+    assert not any([r["type"] == "remote_error" for r in responses])
+    # everything was acked before the drop, nothing is sent twice
+    assert len([r for r in host.received if r["type"] == "txt2img"]) == 4
+    b.stop()
+    b.wait()
+
+def test_legacy_host_gets_unfinished_requests_again(app):
+    host = StubHost(cost=0.2, replay=False, sessions=False)
+    b, responses = connect(app, host)
+    submit(b, range(1, 5))
+    assert run_until(app, lambda: len(result_ids(responses)) == 1)
+
+    host.drop()
+    assert run_until(app, lambda: len(set(result_ids(responses))) == 4)
+    assert sorted(result_ids(responses)) == [1, 2, 3, 4]
+    assert len([r for r in host.received if r["type"] == "txt2img"]) > 4
+    b.stop()
+    b.wait()
+
+def test_unacked_request_is_resubmitted_once(app):
+    host = StubHost(cost=0.1, replay=True, lose_ack=2)
+    b, responses = connect(app, host)
+    submit(b, range(1, 4))
+    assert run_until(app, lambda: len(set(result_ids(responses))) == 3)
+    assert run_until(app, lambda: host.results.count(2) == 2)
+    app.processEvents()
+
+    # the host ran request 2 twice, the client reports it once
+    assert sorted(result_ids(responses)) == [1, 2, 3]
+    b.stop()
+    b.wait()
+
+def test_gives_up_after_reconnect_attempts(app):
+    host = StubHost(cost=0.1)
+    b, responses = connect(app, host, remote_reconnect_attempts=2)
+    host.stop()
+    assert run_until(app, lambda: any([r["type"] == "remote_error" for r in responses]))
+    error = [r for r in responses if r["type"] == "remote_error"][0]
+    assert "gave up after 2 reconnect attempts" in error["data"]["message"]
+    assert statuses(responses).count("Reconnecting") == 2
+    b.stop()
+    b.wait()
+
+def test_reconnect_disabled(app):
+    host = StubHost(cost=0.1)
+    b, responses = connect(app, host, remote_reconnect_attempts=0)
+    host.drop()
+    assert run_until(app, lambda: any([r["type"] == "remote_error" for r in responses]))
+    assert not "Reconnecting" in statuses(responses)
+    b.stop()
+    b.wait()
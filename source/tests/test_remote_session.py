@@ -0,0 +1,54 @@
+import remote
+
+from test_remote_reconnect import connect, result_ids, submit
+from stubs import StubHost, run_until
+
+def run(app, host, monkeypatch):
+    monkeypatch.setattr(remote, "SESSION_TIMEOUT", 0.2)
+    b, responses = connect(app, host, remote_session_key=True)
+    submit(b, range(1, 4))
+    assert run_until(app, lambda: len(result_ids(responses)) == 3)
+    return b, responses
+
+def errors(responses):
+    return [r for r in responses if r["type"] in {"remote_error", "error"}]
+
+def test_prompt_session_reply(app, monkeypatch):
+    host = StubHost(session_delay=0.0)
+    b, responses = run(app, host, monkeypatch)
+    assert not "password" in host.keys[1:]
+    assert not errors(responses)
+    b.stop()
+    b.wait()
+
+def test_late_session_reply_still_switches_keys(app, monkeypatch):
+    host = StubHost(cost=0.1, session_delay=0.5)
+    b, responses = run(app, host, monkeypatch)
+    assert run_until(app, lambda: "session" in host.keys)
+
+    # the requests sent before the late reply stayed on the password key, everything after it uses the session key
+    first = host.keys.index("session")
+    assert first > 1 and not "password" in host.keys[first:]
+
+    # the reconnect negotiates again and gets another late reply
+    mark = len(host.keys)
+    host.drop()
+    assert run_until(app, lambda: "Reconnecting" in [r["data"]["message"] for r in responses if r["type"] == "status"])
+    submit(b, range(4, 7))
+    assert run_until(app, lambda: len(set(result_ids(responses))) == 6)
+    assert run_until(app, lambda: "session" in host.keys[mark:])
+    keys = host.keys[mark:]
+    assert keys[0] == "password" and not "password" in keys[keys.index("session"):]
+
+    assert sorted(result_ids(responses)) == [1, 2, 3, 4, 5, 6]
+    assert not errors(responses)
+    b.stop()
+    b.wait()
+
+def test_host_without_sessions(app, monkeypatch):
+    host = StubHost()
+    b, responses = run(app, host, monkeypatch)
+    assert set(host.keys) == {"password"}
+    assert not errors(responses)
+    b.stop()
+    b.wait()
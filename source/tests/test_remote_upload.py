@@ -0,0 +1,71 @@
+import os
+
+import backend
+import remote
+
+from stubs import FakeGui, StubHost, PASSWORD, run_until
+
+CHUNK = 65536
+
+def connect(app, host, **config):
+    gui = FakeGui(upload_chunk_size=CHUNK, upload_window=4, **config)
+    b = backend.Backend(gui)
+    responses = []
+    b.response.connect(responses.append)
+    b.setEndpoint(host.start(), PASSWORD)
+    assert run_until(app, lambda: any([r["type"] == "options" for r in responses]))
+    return b, responses
+
+def model(tmp_path, chunks):
+    path = tmp_path / "model.safetensors"
+    path.write_bytes(os.urandom(CHUNK * chunks - 100))
+    return str(path)
+
+def upload(b, path):
+    b.makeRequest({"type":"upload", "id":1, "data":{"type":"SD", "file":path}})
+
+def sent(host):
+    return [r["data"] for r in host.received if r["type"] == "chunk"]
+
+def test_stalled_host_is_resumed(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(remote, "UPLOAD_ACK_TIMEOUT", 0.2)
+    host = StubHost(stall=6)
+    b, responses = connect(app, host)
+    path = model(tmp_path, 20)
+    upload(b, path)
+    assert run_until(app, lambda: "model.safetensors" in host.uploaded)
+
+    assert host.uploaded["model.safetensors"]
+    resumes = [d for d in sent(host) if d.get("resume", False)]
+    assert len(resumes) == 1 and not "index" in resumes[0]
+    # only the chunks the host had not acknowledged are sent again
+    indices = [d["index"] for d in sent(host) if "chunk" in d]
+    assert sorted(set(indices)) == list(range(20))
+    assert len(indices) < 20 + 4
+    assert not any([r["type"] == "error" for r in responses])
+    b.stop()
+    b.wait()
+
+def test_silent_host_gives_up(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(remote, "UPLOAD_ACK_TIMEOUT", 0.1)
+    host = StubHost(stall=2, recover=False)
+    b, responses = connect(app, host)
+    upload(b, model(tmp_path, 8))
+    assert run_until(app, lambda: any([r["type"] == "error" for r in responses]))
+
+    error = [r for r in responses if r["type"] == "error"][0]
+    assert error["id"] == 1 and "stalled" in error["data"]["message"]
+    assert len([d for d in sent(host) if d.get("resume", False)]) == remote.UPLOAD_RETRIES
+    b.stop()
+    b.wait()
+
+def test_legacy_host_without_acks(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(remote, "UPLOAD_ACK_TIMEOUT", 0.1)
+    host = StubHost(chunk_acks=False)
+    b, responses = connect(app, host)
+    upload(b, model(tmp_path, 10))
+    assert run_until(app, lambda: "model.safetensors" in host.uploaded)
+    assert host.uploaded["model.safetensors"]
+    assert not any([d.get("resume", False) for d in sent(host)])
+    b.stop()
+    b.wait()
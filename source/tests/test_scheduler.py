@@ -0,0 +1,128 @@
+import backend
+
+RESULT = {"txt2img": "result", "annotate": "annotate", "segmentation": "segmentation", "options": "options"}
+
+class StubInference():
+    # processes requests one at a time in arrival order, like the local inference process
+    def __init__(self):
+        self.fifo = []
+        self.sent = []
+
+    def send(self, request):
+        self.fifo += [request]
+        self.sent += [request.get("id")]
+
+    def complete(self, scheduler):
+        request = self.fifo.pop(0)
+        scheduler.finish({"type": RESULT[request["type"]], "id": request["id"], "data": {}})
+        return request["id"]
+
+def test_interactive_requests_do_not_wait_for_generations():
+    stub = StubInference()
+    scheduler = backend.RequestScheduler(stub.send, 2)
+    for i in range(10):
+        scheduler.submit({"type":"txt2img", "id":100+i}, backend.PRIORITY_BULK, "basic")
+    assert stub.sent == [100, 101]
+
+    scheduler.submit({"type":"annotate", "id":1})
+    scheduler.submit({"type":"options", "id":2})
+    assert stub.sent == [100, 101, 1, 2]
+
+    scheduler.submit({"type":"segmentation", "id":3})
+    assert not 3 in stub.sent
+
+    order = [stub.complete(scheduler) for _ in range(4)]
+    assert order == [100, 101, 1, 2]
+    assert 3 in stub.sent
+
+def test_sources_are_interleaved():
+    stub = StubInference()
+    scheduler = backend.RequestScheduler(stub.send, 1)
+    for i in range(3):
+        scheduler.submit({"type":"txt2img", "id":100+i}, backend.PRIORITY_BULK, "basic")
+    scheduler.submit({"type":"txt2img", "id":200}, backend.PRIORITY_BULK, "merger")
+    while stub.fifo:
+        stub.complete(scheduler)
+    # merger's request goes out before basic's remaining one
+    assert stub.sent == [100, 101, 200, 102]
+
+def test_generation_before_bulk():
+    stub = StubInference()
+    scheduler = backend.RequestScheduler(stub.send, 1)
+    scheduler.submit({"type":"txt2img", "id":1}, backend.PRIORITY_BULK)
+    scheduler.submit({"type":"txt2img", "id":2}, backend.PRIORITY_BULK)
+    scheduler.submit({"type":"txt2img", "id":3})
+    while stub.fifo:
+        stub.complete(scheduler)
+    assert stub.sent == [1, 3, 2]
+
+def test_cancel_queued_request():
+    stub = StubInference()
+    scheduler = backend.RequestScheduler(stub.send, 1)
+    scheduler.submit({"type":"txt2img", "id":1})
+    scheduler.submit({"type":"txt2img", "id":2})
+    assert scheduler.cancel(2)
+    assert not scheduler.cancel(1)
+    stub.complete(scheduler)
+    assert stub.sent == [1]
+    assert scheduler.metrics()[backend.PRIORITY_GENERATION]["queued"] == 0
+
+def test_remote_error_drops_queued_requests():
+    stub = StubInference()
+    scheduler = backend.RequestScheduler(stub.send, 1)
+    for i in range(3):
+        scheduler.submit({"type":"txt2img", "id":i+1})
+    scheduler.finish({"type":"remote_error", "data":{"message":"Connection closed"}})
+    assert scheduler.metrics()["inflight"] == 0
+    assert scheduler.metrics()[backend.PRIORITY_GENERATION]["queued"] == 0
+
+    scheduler.submit({"type":"txt2img", "id":10})
+    assert stub.sent == [1, 10]
+
+def test_untracked_requests_are_sent_immediately():
+    stub = StubInference()
+    scheduler = backend.RequestScheduler(stub.send, 1)
+    scheduler.submit({"type":"txt2img", "id":1})
+    scheduler.submit({"type":"txt2img", "id":2})
+    scheduler.submit({"type":"manage", "id":3, "data":{}})
+    scheduler.submit({"type":"cancel", "data":{"id":1}})
+    assert [r.get("id") for r in stub.fifo] == [1, 3, None]
+
+def test_metrics_record_waits():
+    stub = StubInference()
+    scheduler = backend.RequestScheduler(stub.send, 1)
+    scheduler.submit({"type":"txt2img", "id":1})
+    scheduler.submit({"type":"txt2img", "id":2})
+    stub.complete(scheduler)
+    metrics = scheduler.metrics()[backend.PRIORITY_GENERATION]
+    assert metrics["sent"] == 2
+    assert metrics["max_wait"] >= metrics["mean_wait"] > 0
+
+def test_completions_match_by_id_only():
+    stub = StubInference()
+    scheduler = backend.RequestScheduler(stub.send, 1)
+    scheduler.submit({"type":"options", "id":1})
+    scheduler.submit({"type":"options", "id":2})
+    assert stub.sent == [1]
+
+    # the inference's own startup options request is not tracked and must not free a slot
+    scheduler.finish({"type":"options", "data":{}})
+    scheduler.finish({"type":"options", "id":99, "data":{}})
+    assert stub.sent == [1]
+    assert not scheduler.idle()
+
+    scheduler.finish({"type":"options", "id":1, "data":{}})
+    assert stub.sent == [1, 2]
+    scheduler.finish({"type":"options", "id":2, "data":{}})
+    assert scheduler.idle()
+
+def test_cancelled_queued_request_leaves_others_running():
+    stub = StubInference()
+    scheduler = backend.RequestScheduler(stub.send, 1)
+    scheduler.submit({"type":"txt2img", "id":1})
+    scheduler.submit({"type":"txt2img", "id":2})
+    assert scheduler.cancel(2)
+    scheduler.finish({"type":"aborted", "id":2, "data":{}})
+    assert not scheduler.idle()
+    stub.complete(scheduler)
+    assert scheduler.idle()
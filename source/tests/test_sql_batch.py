@@ -0,0 +1,50 @@
+import types
+
+import pytest
+from PyQt5.QtSql import QSqlQuery
+
+import sql
+
+@pytest.fixture(scope="module")
+def conn(app):
+    if not sql.Database.instance:
+        sql.Database(None)
+    conn = sql.Connection(None)
+    conn.connect()
+    conn.doQuery("CREATE TABLE IF NOT EXISTS batch(k INTEGER UNIQUE);")
+    return conn
+
+def insert(conn, values):
+    q = QSqlQuery(conn.db)
+    q.prepare("INSERT INTO batch(k) VALUES (:k);")
+    q.bindValue(":k", values)
+    return conn.doBatch(q)
+
+def count(conn):
+    q = conn.doQuery("SELECT COUNT(*) FROM batch;")
+    q.next()
+    return q.value(0)
+
+def test_batch_commits(conn):
+    conn.doQuery("DELETE FROM batch;")
+    assert insert(conn, [1, 2, 3])
+    assert count(conn) == 3
+
+def test_failed_batch_rolls_back(conn):
+    conn.doQuery("DELETE FROM batch;")
+    assert not insert(conn, [1, 2, 2, 3])
+    assert count(conn) == 0
+
+def test_rows_only_cached_when_committed(conn):
+    from tabs.explorer import explorer
+    row = ("a", "lora", "a", "LoRA", "", "", "", 0, 0, 0)
+    populater = types.SimpleNamespace(conn=conn, rows={}, pending=[row])
+
+    # the models table does not exist yet, so the batch fails
+    explorer.Populater.finishCategory(populater, "lora", 1)
+    assert populater.rows == {}
+
+    conn.doQuery("CREATE TABLE models(name TEXT, category TEXT, display TEXT, type TEXT, file TEXT, folder TEXT, desc TEXT, idx INTEGER, width INTEGER, height INTEGER, UNIQUE(category, idx));")
+    populater.pending = [row]
+    explorer.Populater.finishCategory(populater, "lora", 1)
+    assert populater.rows == {("lora", 0): row}
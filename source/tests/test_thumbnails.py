@@ -0,0 +1,75 @@
+import io
+import os
+
+import PIL.Image
+
+import thumbnails
+
+def stored(disk):
+    return disk.db.execute("SELECT IFNULL(SUM(LENGTH(data)), 0) FROM thumbnails;").fetchone()[0]
+
+def test_replacing_a_thumbnail_keeps_the_total(tmp_path):
+    disk = thumbnails.ThumbnailDisk(str(tmp_path / "thumbnails.db"), 1024*1024)
+    for i in range(20):
+        disk.put("a.png", 256, (i, 5000), os.urandom(10000 + i))
+    disk.put("b.png", 256, (0, 5000), os.urandom(3000))
+    assert disk.total == stored(disk) == 10019 + 3000
+    assert disk.get("a.png", 256, (19, 5000))
+
+    disk.remove({"a.png"})
+    assert disk.total == stored(disk) == 3000
+
+def test_prune_keeps_the_budget(tmp_path):
+    disk = thumbnails.ThumbnailDisk(str(tmp_path / "thumbnails.db"), 100000)
+    for i in range(30):
+        disk.put(f"{i}.png", 256, (0, 1), os.urandom(10000))
+        disk.put(f"{i}.png", 256, (1, 1), os.urandom(10000))
+        assert disk.total == stored(disk) <= 100000
+    assert len(disk.index) > 5
+
+def encoded(image, format):
+    blob = io.BytesIO()
+    image.save(blob, format)
+    source = PIL.Image.open(io.BytesIO(blob.getvalue()))
+    return PIL.Image.open(io.BytesIO(thumbnails.encode_thumbnail(source, (256, 256), 75)))
+
+def test_thumbnail_sizes():
+    gradient = PIL.Image.linear_gradient("L").resize((1000, 600)).convert("RGB")
+    for format in ["PNG", "JPEG"]:
+        thumbnail = encoded(gradient, format)
+        assert thumbnail.format == "JPEG" and thumbnail.size == (256, 154)
+    assert encoded(gradient.convert("P"), "PNG").size == (256, 154)
+    assert encoded(gradient.resize((200, 100)), "PNG").size == (200, 100)
+
+def test_webp_outputs_embed_a_preview(app, tmp_path):
+    import manager
+    from PyQt5.QtGui import QImage
+
+    image = PIL.Image.linear_gradient("L").resize((768, 512)).convert("RGB")
+    for preview in [True, False]:
+        options = {"format": "webp", "method": 0, "preview": preview}
+        writer = manager.OutputWriter(image, None, str(tmp_path), str(preview), "out", options)
+        writer.run()
+
+        file = str(tmp_path / str(preview) / "out.webp")
+        with PIL.Image.open(file) as saved:
+            assert saved.size == (768, 512)
+        assert not QImage(file).isNull()
+
+        blob = thumbnails.get_embedded_thumbnail(file, (128, 128), 75)
+        if preview:
+            assert PIL.Image.open(io.BytesIO(blob)).size[0] == 128
+        else:
+            assert blob == None
+
+def test_stale_disk_entries_are_not_cached(app, tmp_path):
+    file = str(tmp_path / "a.png")
+    PIL.Image.new("RGB", (512, 512)).save(file)
+    db = str(tmp_path / "thumbnails.db")
+    thumbnails.ThumbnailStorage((256, 256), (512, 512), 75, file=db).put(file, b"thumbnail", (256, 256))
+
+    assert thumbnails.ThumbnailStorage((256, 256), (512, 512), 75, file=db).has(file, (256, 256))
+
+    PIL.Image.new("RGB", (512, 512), "red").save(file)
+    os.utime(file, ns=(0, os.stat(file).st_mtime_ns + 10**9))
+    assert not thumbnails.ThumbnailStorage((256, 256), (512, 512), 75, file=db).has(file, (256, 256))
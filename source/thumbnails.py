@@ -1,7 +1,11 @@
 import io
 import os
+import sqlite3
+import struct
+import zlib
+import collections
 
-from PyQt5.QtCore import pyqtSlot, pyqtSignal, QObject, QMutex, QRunnable, QThreadPool, QUrl, QByteArray, QThread, QSize
+from PyQt5.QtCore import pyqtSlot, pyqtSignal, QObject, QMutex, QRunnable, QThreadPool, QUrl, QByteArray, QThread, QSize, QBuffer, QIODevice, Qt
 from PyQt5.QtSql import QSqlQuery
 from PyQt5.QtQuick import QQuickImageProvider, QQuickAsyncImageProvider, QQuickImageResponse, QQuickTextureFactory
 from PyQt5.QtGui import QImage
@@ -11,18 +15,283 @@ import PIL.Image
 import filesystem
 import sql
 
-def get_thumbnail(file, size, quality):
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PREVIEW_CHUNK = b"qdTH"
+PREVIEW_SIZE = (256, 256)
+PREVIEW_QUALITY = 75
+
+EXIF_IFD = 0x8769
+EXIF_USER_COMMENT = 0x9286
+EXIF_IMAGE_DESCRIPTION = 0x010E
+
+def encode_thumbnail(image, size, quality):
     blob = io.BytesIO()
-    image = PIL.Image.open(file).convert('RGB')
-    image.thumbnail(size, PIL.Image.ANTIALIAS)
-    image.save(blob, "JPEG", quality=quality)
+    # JPEGs are decoded straight at the smallest DCT scale that still covers the size,
+    # everything else is box reduced by a whole factor before the final resample
+    image.draft(None, size)
+    if not image.mode in {"RGB", "RGBA", "L"}:
+        image = image.convert("RGBA")
+    factor = min(image.size[0] // size[0], image.size[1] // size[1])
+    if factor > 1:
+        image = image.reduce(factor)
+    image.thumbnail(size, PIL.Image.ANTIALIAS, reducing_gap=None)
+    image.convert("RGB").save(blob, "JPEG", quality=quality)
     return blob.getvalue()
 
+def get_preview(image):
+    return encode_thumbnail(image.copy(), PREVIEW_SIZE, PREVIEW_QUALITY)
+
+def read_png_info(file):
+    width, height, text, preview = 0, 0, {}, None
+    with open(file, "rb") as f:
+        if f.read(8) != PNG_SIGNATURE:
+            return None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, cid = struct.unpack(">I4s", header)
+            if cid in {b"IDAT", b"IEND"}:
+                break
+            if not cid in {b"IHDR", b"tEXt", b"zTXt", b"iTXt", PREVIEW_CHUNK}:
+                f.seek(length + 4, os.SEEK_CUR)
+                continue
+            data = f.read(length)
+            f.seek(4, os.SEEK_CUR)
+            try:
+                if cid == b"IHDR":
+                    width, height = struct.unpack(">II", data[:8])
+                elif cid == PREVIEW_CHUNK:
+                    preview = data
+                elif cid == b"tEXt":
+                    k, v = data.split(b"\0", 1)
+                    text[k.decode("latin-1")] = v.decode("latin-1")
+                elif cid == b"zTXt":
+                    k, v = data.split(b"\0", 1)
+                    text[k.decode("latin-1")] = zlib.decompress(v[1:]).decode("latin-1")
+                elif cid == b"iTXt":
+                    k, v = data.split(b"\0", 1)
+                    compressed, v = v[0], v[2:]
+                    _, _, v = v.split(b"\0", 2)
+                    if compressed:
+                        v = zlib.decompress(v)
+                    text[k.decode("latin-1")] = v.decode("utf-8")
+            except Exception:
+                continue
+    return width, height, text, preview
+
+def make_png_chunk(cid, data):
+    return struct.pack(">I", len(data)) + cid + data + struct.pack(">I", zlib.crc32(cid + data) & 0xFFFFFFFF)
+
+def make_text_chunk(key, value):
+    try:
+        return make_png_chunk(b"tEXt", key.encode("latin-1") + b"\0" + value.encode("latin-1"))
+    except UnicodeError:
+        return make_png_chunk(b"iTXt", key.encode("latin-1") + b"\0\0\0\0\0" + value.encode("utf-8"))
+
+def insert_png_chunks(data, chunks):
+    if data[:8] != PNG_SIGNATURE:
+        return None
+    offset = 8
+    while offset + 8 <= len(data):
+        length, cid = struct.unpack(">I4s", data[offset:offset+8])
+        if cid == b"IDAT":
+            return b"".join([data[:offset]] + chunks + [data[offset:]])
+        offset += length + 12
+    return None
+
+def insert_webp_chunk(data, cid, payload):
+    # unknown chunks are only allowed in the extended format, which we always get since EXIF is written
+    if data[:4] != b"RIFF" or data[8:12] != b"WEBP" or data[12:16] != b"VP8X":
+        return None
+    data = data + cid + struct.pack("<I", len(payload)) + payload + b"\0" * (len(payload) % 2)
+    return data[:4] + struct.pack("<I", len(data) - 8) + data[8:]
+
+def read_webp_preview(file):
+    with open(file, "rb") as f:
+        header = f.read(12)
+        if header[:4] != b"RIFF" or header[8:12] != b"WEBP":
+            return None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            cid, length = struct.unpack("<4sI", header)
+            if cid == PREVIEW_CHUNK:
+                return f.read(length)
+            f.seek(length + length % 2, os.SEEK_CUR)
+
+def get_image_preview(image):
+    size = QSize(*PREVIEW_SIZE)
+    if image.width() > size.width() or image.height() > size.height():
+        image = image.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    image = image.convertToFormat(QImage.Format_RGB888)
+    ba = QByteArray()
+    bf = QBuffer(ba)
+    bf.open(QIODevice.WriteOnly)
+    image.save(bf, "JPEG", PREVIEW_QUALITY)
+    return ba.data()
+
+def image_to_pil(image):
+    if image.hasAlphaChannel():
+        mode, image = "RGBA", image.convertToFormat(QImage.Format_RGBA8888)
+    else:
+        mode, image = "RGB", image.convertToFormat(QImage.Format_RGB888)
+    data = image.constBits().asstring(image.sizeInBytes())
+    return PIL.Image.frombuffer(mode, (image.width(), image.height()), data, "raw", mode, image.bytesPerLine(), 1)
+
+def make_exif(text):
+    exif = PIL.Image.Exif()
+    if "parameters" in text:
+        exif[EXIF_IFD] = {EXIF_USER_COMMENT: b"UNICODE\0" + text["parameters"].encode("utf-16be")}
+    if "recipe" in text:
+        exif[EXIF_IMAGE_DESCRIPTION] = text["recipe"]
+    return exif.tobytes()
+
+def read_exif_text(exif):
+    text = {}
+    comment = exif.get_ifd(EXIF_IFD).get(EXIF_USER_COMMENT, None) or exif.get(EXIF_USER_COMMENT, None)
+    if comment:
+        if type(comment) == bytes:
+            if comment.startswith(b"UNICODE\0"):
+                comment = comment[8:].decode("utf-16be", errors="ignore")
+            else:
+                comment = comment[8:].decode("utf-8", errors="ignore")
+        text["parameters"] = comment
+    recipe = exif.get(EXIF_IMAGE_DESCRIPTION, None)
+    if recipe:
+        text["recipe"] = recipe
+    return text
+
+def read_image_info(file):
+    if file.lower().endswith(".png"):
+        return read_png_info(file)
+    with PIL.Image.open(file) as image:
+        width, height = image.size
+        text = {k:v for k,v in image.info.items() if type(v) == str}
+        text.update(read_exif_text(image.getexif()))
+    return width, height, text, None
+
+def get_embedded_thumbnail(file, size, quality):
+    if file.lower().endswith(".png"):
+        info = read_png_info(file)
+        preview = info[3] if info else None
+    elif file.lower().endswith(".webp"):
+        preview = read_webp_preview(file)
+    else:
+        return None
+    if not preview:
+        return None
+    with PIL.Image.open(io.BytesIO(preview)) as image:
+        w, h = image.size
+        if w < size[0] and h < size[1]:
+            return None
+        image.thumbnail(size, PIL.Image.ANTIALIAS)
+        if image.size == (w, h):
+            return preview
+        return encode_thumbnail(image, size, quality)
+
+def get_thumbnail(file, size, quality):
+    try:
+        blob = get_embedded_thumbnail(file, size, quality)
+        if blob:
+            return blob
+    except Exception:
+        pass
+
+    with PIL.Image.open(file) as image:
+        return encode_thumbnail(image, size, quality)
+
+def get_signature(file):
+    try:
+        stat = os.stat(file)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+class ThumbnailDisk():
+    def __init__(self, file, budget):
+        self.budget = budget
+        self.index = {}
+        self.total = 0
+        self.db = None
+        try:
+            self.db = sqlite3.connect(file, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL;")
+            self.db.execute("PRAGMA synchronous=NORMAL;")
+            self.db.execute("CREATE TABLE IF NOT EXISTS thumbnails(file TEXT, size INTEGER, mtime INTEGER, length INTEGER, data BLOB, PRIMARY KEY (file, size));")
+            for file, size, mtime, length in self.db.execute("SELECT file, size, mtime, length FROM thumbnails;"):
+                self.index[(file, size)] = (mtime, length)
+            self.prune()
+        except sqlite3.Error:
+            self.db = None
+            self.index = {}
+
+    def has(self, file, size, signature):
+        return bool(signature) and self.index.get((file, size)) == signature
+
+    def get(self, file, size, signature):
+        if not self.db or self.index.get((file, size)) != signature:
+            return None
+        row = self.db.execute("SELECT data FROM thumbnails WHERE file = ? AND size = ?;", (file, size)).fetchone()
+        return row[0] if row else None
+
+    def stored(self, keys):
+        # the length column is the source file size from the signature, the blob size has to be asked for
+        z = 0
+        for key in keys:
+            row = self.db.execute("SELECT LENGTH(data) FROM thumbnails WHERE file = ? AND size = ?;", key).fetchone()
+            z += row[0] if row and row[0] else 0
+        return z
+
+    def put(self, file, size, signature, blob):
+        if not self.db or not signature:
+            return
+        try:
+            replaced = self.stored([(file, size)]) if (file, size) in self.index else 0
+            self.db.execute("INSERT OR REPLACE INTO thumbnails(file, size, mtime, length, data) VALUES (?, ?, ?, ?, ?);", (file, size, *signature, blob))
+        except sqlite3.Error:
+            return
+        self.index[(file, size)] = signature
+        self.total += len(blob) - replaced
+        if self.total > self.budget:
+            self.prune()
+
+    def remove(self, files):
+        keys = [k for k in self.index if k[0] in files]
+        if not self.db or not keys:
+            return
+        for key in keys:
+            del self.index[key]
+        try:
+            removed = self.stored(keys)
+            self.db.executemany("DELETE FROM thumbnails WHERE file = ? AND size = ?;", keys)
+            self.total -= removed
+        except sqlite3.Error:
+            pass
+
+    def prune(self):
+        self.total = self.db.execute("SELECT IFNULL(SUM(LENGTH(data)), 0) FROM thumbnails;").fetchone()[0]
+        if self.total <= self.budget:
+            return
+        target = self.budget * 3 // 4
+        removed = []
+        for rowid, file, size, z in self.db.execute("SELECT rowid, file, size, LENGTH(data) FROM thumbnails ORDER BY rowid;"):
+            if self.total <= target:
+                break
+            removed += [(rowid,)]
+            self.index.pop((file, size), None)
+            self.total -= z
+        self.db.executemany("DELETE FROM thumbnails WHERE rowid = ?;", removed)
+
 class ThumbnailStorage(QObject):
     instance = None
-    def __init__(self, size, big_size, quality, parent=None):
+    def __init__(self, size, big_size, quality, parent=None, file="thumbnails.db", memory=64, disk=1024):
         super().__init__(parent)
-        self.cache = {size: {}, big_size: {}}
+        self.cache = collections.OrderedDict()
+        self.used = 0
+        self.budget = memory * 1024 * 1024
+        self.disk = ThumbnailDisk(file, disk * 1024 * 1024)
         self.guard = QMutex()
         ThumbnailStorage.instance = self
 
@@ -30,33 +299,66 @@ class ThumbnailStorage(QObject):
         self.sync_provider = SyncThumbnailProvider(size, quality)
         self.big_provider = AsyncThumbnailProvider(big_size, quality)
 
+    def key(self, file, size):
+        return (file, size[0] * 65536 + size[1])
+
     def get(self, file, size):
+        key = self.key(file, size)
+        self.guard.lock()
+        image = self.cache.get(key, None)
+        if image:
+            self.cache.move_to_end(key)
+        self.guard.unlock()
+        if image:
+            return image
+
+        signature = get_signature(file)
+        if not signature:
+            return None
+        
         self.guard.lock()
-        image = self.cache[size].get(file, None)
+        image = self.disk.get(*key, signature)
+        if image:
+            self.store(key, image)
         self.guard.unlock()
         return image
     def put(self, file, image, size):
+        key = self.key(file, size)
+        signature = get_signature(file)
         self.guard.lock()
-        self.cache[size][file] = image
+        self.store(key, image)
+        self.disk.put(*key, signature, image)
         self.guard.unlock()
     def has(self, file, size):
+        key = self.key(file, size)
         self.guard.lock()
-        out = file in self.cache[size]
+        out = key in self.cache
         self.guard.unlock()
-        return out
-    def remove(self, file):
+        if out:
+            return True
+        # a stale disk entry would be rejected by get, so it must not count as cached
+        signature = get_signature(file)
         self.guard.lock()
-        for size in self.cache:
-            if file in self.cache[size]:
-                del self.cache[size][file]
+        out = self.disk.has(*key, signature)
         self.guard.unlock()
+        return out
+    def remove(self, file):
+        self.removeAll([file])
     def removeAll(self, files):
+        files = set(files)
         self.guard.lock()
-        for size in self.cache:
-            for file in files:
-                if file in self.cache[size]:
-                    del self.cache[size][file]
+        for key in [k for k in self.cache if k[0] in files]:
+            self.used -= len(self.cache.pop(key))
+        self.disk.remove(files)
         self.guard.unlock()
+    def store(self, key, image):
+        if key in self.cache:
+            self.used -= len(self.cache.pop(key))
+        self.cache[key] = image
+        self.used += len(image)
+        while self.used > self.budget and len(self.cache) > 1:
+            _, evicted = self.cache.popitem(last=False)
+            self.used -= len(evicted)
 
 class ThumbnailResponseRunnableSignals(QObject):
     done = pyqtSignal('QImage')